@@ -0,0 +1,157 @@
+# per cell message totals at every level of the geoblock hierarchy
+# message_facade reports changes per block cell here. They are rolled up to each level and buffered, a flusher
+# thread applies them every AGGREGATE_FLUSH_INTERVAL seconds with INSERT ... ON CONFLICT DO UPDATE statements
+# (postgres 9.5+, sqlite 3.24+), so posts and votes don't each write the coarse rows a whole region shares.
+# Rows are always written in (level, key) order so concurrent flushes can't deadlock on each other's rows
+
+import atexit
+import threading
+import time
+
+from django.db import connection, close_old_connections
+from django.db.models import Count, Max, Sum
+from drop.models import CellAggregate, Message
+from .constants import GEOLOC_LEVELS, AGGREGATE_FLUSH_INTERVAL, AGGREGATE_MAX_BUFFERED
+from .geo import parent_cell, neighbour_cells, cell_centre
+from . import socket_log
+
+UPSERT_BATCH = 200  # aggregate rows per statement
+
+_lock = threading.Lock()
+_pending = {}  # (level, key) -> [message delta, vote delta, latest post date or None] not yet written
+_flusher = None
+
+
+def _add(rows, key, messages, votes, latest):
+	row = rows.get(key)
+	if row is None:
+		row = rows[key] = [0, 0, None]
+	row[0] += messages
+	row[1] += votes
+	if latest is not None and (row[2] is None or latest > row[2]):
+		row[2] = latest
+
+
+# apply changes given as block cell -> (message delta, vote delta, latest post date or None)
+def record(changes):
+	with _lock:
+		for cell, (messages, votes, latest) in changes.items():
+			for level in range(GEOLOC_LEVELS + 1):
+				_add(_pending, (level, parent_cell(cell, level)), messages, votes, latest)
+		full = len(_pending) >= AGGREGATE_MAX_BUFFERED
+
+	_start_flusher()
+	if full:
+		flush()
+
+
+# write buffered changes back to the db
+def flush():
+	global _pending
+	with _lock:
+		rows, _pending = _pending, {}
+
+	try:
+		_write(rows)
+	except Exception:
+		# keep the changes for the next flush
+		with _lock:
+			for key, (messages, votes, latest) in rows.items():
+				_add(_pending, key, messages, votes, latest)
+		raise
+
+
+def _write(rows):
+	rows = sorted((level, key, m, v, latest) for (level, key), (m, v, latest) in rows.items() if m or v or latest)
+	for i in range(0, len(rows), UPSERT_BATCH):
+		_upsert(rows[i:i + UPSERT_BATCH])
+
+
+def _upsert(rows):
+	table = connection.ops.quote_name(CellAggregate._meta.db_table)
+	values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))
+	params = []
+	for level, key, messages, votes, latest in rows:
+		params += [level, key, messages, votes, connection.ops.adapt_datetimefield_value(latest)]
+
+	with connection.cursor() as cursor:
+		cursor.execute(
+			f"INSERT INTO {table} (level, key, messages, votes, latest) VALUES {values} "
+			f"ON CONFLICT (level, key) DO UPDATE SET "
+			f"messages = {table}.messages + excluded.messages, "
+			f"votes = {table}.votes + excluded.votes, "
+			f"latest = CASE WHEN {table}.latest IS NULL OR excluded.latest > {table}.latest "
+			f"THEN excluded.latest ELSE {table}.latest END",
+			params
+		)
+
+
+# recompute every aggregate from the messages table. Only this process's buffer is dropped (its changes are in the
+# messages table already), changes still buffered by running servers would be counted twice when they flush, so
+# stop them first
+def rebuild():
+	with _lock:
+		_pending.clear()
+	CellAggregate.objects.all().delete()
+
+	rows = {}
+	for b in Message.objects.values('cell').annotate(messages=Count('id'), votes=Sum('votes'), latest=Max('date')):
+		for level in range(GEOLOC_LEVELS + 1):
+			_add(rows, (level, parent_cell(b['cell'], level)), b['messages'], b['votes'], b['latest'])
+	_write(rows)
+
+
+# serialized aggregates of the cell at the level containing the block and the cells around it,
+# with the changes still buffered in this process added
+def summary(cell, level):
+	key = parent_cell(cell, level)
+	keys = neighbour_cells(key, level)
+	totals = {a.key: [a.messages, a.votes, a.latest] for a in CellAggregate.objects.filter(level=level, key__in=keys)}
+	with _lock:
+		for k in keys:
+			if (level, k) in _pending:
+				messages, votes, latest = _pending[(level, k)]
+				_add(totals, k, messages, votes, latest)
+
+	result = []
+	for k, (messages, votes, latest) in sorted(totals.items()):
+		lat, long = cell_centre(k, level)
+		result.append({
+			"level": level,
+			"cell": k,
+			"lat": lat,
+			"long": long,
+			"messages": messages,
+			"votes": votes,
+			"latest": latest.strftime("%d/%m/%Y") if latest else None,
+			"centre": k == key
+		})
+	return result
+
+
+# drop the buffered changes without writing them, e.g. before the database they were recorded against goes away
+def discard():
+	with _lock:
+		_pending.clear()
+
+
+def _run_flusher():
+	while True:
+		time.sleep(AGGREGATE_FLUSH_INTERVAL)
+		close_old_connections()
+		try:
+			flush()
+		except Exception as e:
+			socket_log.task("aggregates", "flush failed", error=e)
+		finally:
+			close_old_connections()
+
+
+def _start_flusher():
+	global _flusher
+	if _flusher is None:
+		with _lock:
+			if _flusher is None:
+				_flusher = threading.Thread(target=_run_flusher, name="drop-aggregate-flusher", daemon=True)
+				_flusher.start()
+				atexit.register(flush)
@@ -5,4 +5,43 @@ DELETE_THRESH = -5  # vote threshhold for message deletion
 GEOLOC_RESOLUTION = 2  # decimal places of geolocation precision
 MAX_MESSAGE_LENGTH = 240 # maximum length of a message
 MAX_RANGE = 2 # maximum search radius for messages around a geoloc
-PAGE_SIZE = 10
\ No newline at end of file
+PAGE_SIZE = 10
+ASYNC_CONSUMER = False  # serve ws/ with the async consumer instead of the thread per frame one
+DB_EXECUTOR_WORKERS = 8  # threads (and db connections) used by async consumers for db work
+NOTIFY_PAYLOAD_MAX_BYTES = 2048  # largest serialized message sent inside a notify event, bigger ones are sent by id
+PAGE_CACHE_ALIAS = "default"  # django cache used for shared message pages, point it at redis to share across processes
+PAGE_CACHE_TTL = 30  # seconds a cached message page is served before it is re-queried
+SEEN_FLUSH_INTERVAL = 10  # seconds between write backs of buffered seen counts
+SEEN_MAX_BUFFERED = 5000  # buffered message ids that force an early write back
+SEEN_FLUSH_BATCH = 500  # max ids per seen UPDATE statement
+VOTE_COALESCE_INTERVAL = 0  # seconds between coalesced vote writes, 0 writes every vote straight away
+VOTE_KNOWN_MAX = 10000  # messages whose vote count is remembered for answering coalesced votes
+VOTE_WRITE_BATCH = 500  # max messages per vote UPDATE / DELETE statement
+CELL_MAX_RANGES = 16  # most cell key ranges a block range query is split into
+CELL_COVER_QUADS = 256  # boxes with a longer perimeter (in blocks / this) are covered with coarser quads
+GEOLOC_LEVELS = 6  # coarser levels above a geoblock, each doubles the cell side (level 6 is ~0.64 degrees)
+MAX_RADIUS_KM = 25  # maximum radius of a distance search around a geoloc
+EARTH_RADIUS_KM = 6371.0088  # mean earth radius used for great circle distances
+MAX_NEAREST = 100  # most messages a nearest messages search returns
+HOT_DECAY_SECONDS = 45000  # age that costs a message as much hot rank as a tenfold drop in votes (12.5 hours)
+MESSAGE_TTL_HOURS = 48  # hours a message lives before it expires
+EXPIRY_SWEEP_INTERVAL = 60  # seconds between sweeps deleting expired messages
+EXPIRY_SWEEP_BATCH = 1000  # max expired messages deleted per statement
+EXPIRY_SWEEP_MAX_BATCHES = 50  # max statements per background sweep, the rest waits for the next one
+TOKEN_CACHE_MAX = 10000  # verified socket tokens kept in memory
+TOKEN_REVALIDATE_SECONDS = 60  # seconds a cached token is trusted before it is verified again, caps revocation delay
+MESSAGE_CACHE_MAX = 10000  # serialized messages kept in memory
+STUB_INDEX_MAX_BLOCKS = 1000  # geoblocks whose message stubs are kept in memory
+STUB_INDEX_TTL = 60  # seconds before a block's stubs are reloaded to pick up other processes' writes
+NEAREST_MAX_BLOCKS = 1024  # furthest a nearest messages search looks, in blocks out from the geoloc's block (~10 degrees)
+LOG_SAMPLE_RATE = 0.01  # share of websocket frames written to the socket log, every frame is still counted
+LOG_SAMPLE_RATES = {"socket": 1.0, "token": 1.0, "error": 1.0}  # sample rates by request code or response category
+LOG_MAX_CHARS = 256  # longest frame payload written to the socket log, longer ones are truncated
+LOG_QUEUE_MAX = 10000  # socket log records waiting to be written, records past this are dropped
+BATCH_MAX_REQUESTS = 16  # most requests a batch frame (category 20) may carry
+NOTIFY_BATCH_WINDOW = 0.25  # seconds a group's new message notifications are collected for before one event is sent, 0 sends each post straight away
+NOTIFY_BATCH_MAX = 50  # notifications that send a group's batch before its window is up
+AGGREGATE_FLUSH_INTERVAL = 5  # seconds between write backs of buffered cell aggregate changes
+AGGREGATE_MAX_BUFFERED = 5000  # buffered aggregate rows that force an early write back
+NOTIFY_REGISTRY_ALIAS = "default"  # django cache advertising the levels sockets subscribe at, must be shared by every process
+NOTIFY_LEVEL_REFRESH = 60  # seconds between a process re-advertising the levels its sockets subscribe at
@@ -1,34 +1,29 @@
-# websocket server consumer
+# websocket server consumers
 # Jeremy vun 2726092
 
 # websocket imports
 from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
-import json
-
-# authentication imports
-from django.contrib.auth.models import AnonymousUser
-from rest_framework.exceptions import ValidationError
-
-from drop.custom_exceptions import TokenError
-from .drfjwt.serializers import VerifyAuthTokenSerializer
-from django.db import close_old_connections
+from channels.generic.websocket import WebsocketConsumer, AsyncWebsocketConsumer
 
 # business imports
-from .util import *
-from drop import message_facade as mf
+from .protocol import MessagesProtocol
+from .executor import run_in_db_executor
+from .expiry import start_sweeper
+from .encoding import MSGPACK_SUBPROTOCOL
+from . import socket_log, metrics, notify_batcher
 
 
-class MessagesConsumer(WebsocketConsumer):
-    notified_id = 0
-    last_code = None
-    qs_cache = None
+# thread per frame consumer, every channel layer call is wrapped in async_to_sync
+class MessagesConsumer(MessagesProtocol, WebsocketConsumer):
 
     # don't need to authenticate to connect, only when requesting data
     def connect(self):
-        self.accept()
+        start_sweeper()
+        self.binary = MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", [])
+        self.accept(MSGPACK_SUBPROTOCOL if self.binary else None)
         try:
-            print(f"[SOCK]<ANON> opened")
+            socket_log.event(None, "opened")
+            metrics.socket_opened()
             self.geoloc = None
         except Exception as e:
             self.send_message_to_client("error", str(e))
@@ -36,271 +31,114 @@ class MessagesConsumer(WebsocketConsumer):
 
     # unsubscribe us from the layer group after we disconnect
     def disconnect(self, close_code):
-        if self.geoloc:
-            async_to_sync(self.channel_layer.group_discard)(
-                self.geoloc.get_block_name(),
-                self.channel_name
-            )
-
-    # Route client request according to category code
-    # 0. post message
-    # 1. retrieve ranked messages
-    # 2. retrieve new messages
-    # 3. retrieve random messages
-    # 4. retrieve messages in range
-    # noinspection PyMethodOverriding
-    def receive(self, text_data):
-        try:
-            close_old_connections()
-            json_data = json.loads(text_data)
-            code = json_data['category']
-
-            # user authentication
-            if code == 11 or self.geoloc is None or self.scope["user"].id is None:
-                try:
-                    print(f">>[REC]<Anon>: {json_data}")
-
-                    # parse the geolocation
-                    self.geoloc = parse_geoloc(json_data["lat"], json_data["long"])
-                    if self.geoloc is not None:
-                        # authenticate the user
-                        user = authenticate_token(json_data["token"])
-                        self.scope["user"] = user
-
-                        # user is authenticated with a valid geolocation
-                        print(f"@[SOCK]<{user.username}> Opened @({self.geoloc.get_block_string()})")
-
-                        # add user to a geoblock layer group
-                        if self.geoloc and self.geoloc.is_valid():
-                            async_to_sync(self.channel_layer.group_add)(
-                                self.geoloc.get_block_name(),
-                                self.channel_name
-                            )
-                            self.send_message_to_client("socket", "open")
-                    else:
-                        raise ValueError("Invalid Geolocation")
-                except:
-                    raise TokenError("Invalid Access Token")
-
-            # user is authenticated, receive the client message and route based on category code
-            else:
-                print(f">>[REC][{self.scope['user'].username}]: {text_data}")
-
-                # client wishes to close the socket
-                if code == 9:
-                    self.send_message_to_client("socket", "closed")
-                    self.close()
-
-                # create message
-                elif code == 0:
-                    m = mf.create_message(geoloc=self.geoloc, message=parse_message(json_data['data']), user_id=self.scope["user"].id)
-                    if m:
-                        json_response = json.dumps({
-                            "echo": serialize_message(m),
-                            "result": True,
-                            "meta": ""
-                        })
-                        self.send_message_to_client("post", json_response)
-                        self.notify_geoloc_group(m)
-                    else:
-                        json_response = json.dumps({
-                            "echo": serialize_message(m),
-                            "result": False,
-                            "meta": "duplicate"
-                        })
-                        self.send_message_to_client("post", json_response)
-
-                elif code == 10:
-                    mf.delete_message(json_data['data'], self.scope['user'].id)
-
-                # change geolocation
-                elif code == 1:
-                    new_geoloc = Geoloc(json_data['lat'], json_data['long'])
-                    if new_geoloc.is_valid():
-                        # leave current group
-                        async_to_sync(self.channel_layer.group_discard)(
-                            self.geoloc.get_block_name(),
-                            self.channel_name
-                        )
-
-                        # join new group
-                        self.geoloc = new_geoloc
-                        async_to_sync(self.channel_layer.group_add)(
-                            self.geoloc.get_block_name(),
-                            self.channel_name
-                        )
-
-                        self.send_message_to_client("geoloc", json.dumps({
-                            "result": True,
-                            "lat": self.geoloc.lat,
-                            "long": self.geoloc.long
-                        }))
-                    else:
-                        self.send_message_to_client("geoloc", json.dumps({
-                            "result": False,
-                            "lat": self.geoloc.lat,
-                            "long": self.geoloc.long
-                        }))
-
-                # retrieve a single message
-                elif code == 12:
-                    msg_id = int(json_data["data"])
-                    m = mf.retrieve_single_message(msg_id)
-                    m = serialize_message(m)
-                    self.send_message_to_client("single", m)
+        socket_log.event(self.scope["user"].username, "closed", code=close_code)
+        metrics.socket_closed()
+        self.unsubscribe()
 
-                # retrieve all messages in geolocation but return only stubs
-                elif code == 13:
-                    response = mf.retrieve_message_stubs(geoloc=self.geoloc)
-                    self.send_message_to_client("stubs", response)
+    def receive(self, text_data=None, bytes_data=None):
+        self.handle_frame(text_data, bytes_data)
 
-                # Upvote
-                elif code == 7:
-                    msg_id = int(json_data["data"])
-                    votes = mf.upvote(msg_id)
-                    if votes is None:
-                        json_response = json.dumps({
-                            "id": msg_id,
-                            "success": False,
-                            "meta": "Not found"
-                        })
-                        self.send_message_to_client("vote", json_response)
-                    else:
-                        json_response = json.dumps({
-                            "id": msg_id,
-                            "success": True,
-                            "meta": str(votes)
-                        })
-                        self.send_message_to_client("vote", json_response)
-
-                # Downvote
-                elif code == 8:
-                    msg_id = int(json_data["data"])
-                    votes = mf.downvote(msg_id)
-                    if votes is None:
-                        json_response = json.dumps({
-                            "id": msg_id,
-                            "success": False,
-                            "meta": "Not found"
-                        })
-                        self.send_message_to_client("vote", json_response)
-                    else:
-                        json_response = json.dumps({
-                            "id": msg_id,
-                            "success": True,
-                            "meta": str(votes)
-                        })
-                        self.send_message_to_client("vote", json_response)
-
-                # we already have a query set paginated, return the requested page instead of hitting DB
-                else:
-                    page_num = max(1, parse_int(json_data['page']))
+    # handle receiving a new message
+    def receive_notification(self, event):
+        self.handle_notification(event)
 
-                    if code == self.last_code and self.qs_cache:
-                        if page_num > self.qs_cache.num_pages:
-                            self.send_retrieved_messages([]) # send empty is emmpty
-                        else:
-                            self.send_retrieved_messages(self.qs_cache.page(page_num))
+    def receive_notification_batch(self, event):
+        self.handle_notification_batch(event)
 
-                    # Messages by vote ranking
-                    elif code == 2:
-                        self.qs_cache = mf.retrieve_messages_ranked(geoloc=self.geoloc)
-                        self.last_code = 2
-                        page_num = min(page_num, self.qs_cache.num_pages)
-                        self.send_retrieved_messages(self.qs_cache.page(page_num))
+    def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            self.send(bytes_data=frame)
+        else:
+            self.send(text_data=frame)
 
-                    # Newest Messages
-                    elif code == 3:
-                        self.qs_cache = mf.retrieve_messages_new(geoloc=self.geoloc)
-                        self.last_code = 3
-                        page_num = min(page_num, self.qs_cache.num_pages)
-                        self.send_retrieved_messages(self.qs_cache.page(page_num))
+    def close_socket(self):
+        self.close()
 
-                    # Messages sorted randomly
-                    elif code == 4:
-                        self.qs_cache = mf.retrieve_messages_random(geoloc=self.geoloc)
-                        self.last_code = 4
-                        page_num = min(page_num, self.qs_cache.num_pages)
-                        self.send_retrieved_messages(self.qs_cache.page(page_num))
+    def join_group(self, group):
+        metrics.group_joined(group, self.channel_name)
+        async_to_sync(self.channel_layer.group_add)(group, self.channel_name)
 
-                    # Messages within a lat/long area
-                    elif code == 5:
-                        self.qs_cache = mf.retrieve_messages_range(geoloc=self.geoloc, geoloc_range=parse_coord_range(json_data['data']))
-                        self.last_code = 5
-                        page_num = min(page_num, self.qs_cache.num_pages)
-                        self.send_retrieved_messages(self.qs_cache.page(page_num))
+    def leave_group(self, group):
+        metrics.group_left(group, self.channel_name)
+        async_to_sync(self.channel_layer.group_discard)(group, self.channel_name)
 
-                    # Messages posted by the user
-                    elif code == 6:
-                        self.qs_cache = mf.retrieve_user_messages(self.scope["user"].id)
-                        self.last_code = 6
-                        page_num = min(page_num, self.qs_cache.num_pages)
-                        self.send_retrieved_messages(self.qs_cache.page(page_num))
+    def send_group(self, group, event):
+        async_to_sync(self.channel_layer.group_send)(group, event)
 
-        # handle exceptions
-        except Exception as e:
-            if e is TokenError:
-                self.send_message_to_client("token", f"{e}")
-            else:
-                self.send_message_to_client("error", f"{e}")
+    def notify_group(self, group, notification):
+        async_to_sync(notify_batcher.add)(self.channel_layer, group, notification)
 
-            self.close()
 
-    # notify whole group of a new message
-    def notify_geoloc_group(self, message):
-        if message:
-            self.notified_id = message.pk
-            async_to_sync(self.channel_layer.group_send)(
-                str(self.geoloc.get_block_name()),
-                {
-                    # type specifies the function to be called when received
-                    'type': 'receive_notification',
-                    'id': message.pk
-                }
-            )
+# event loop consumer, protocol handlers run on the bounded db executor and only
+# the socket / channel layer effects they produce are awaited on the loop
+class AsyncMessagesConsumer(MessagesProtocol, AsyncWebsocketConsumer):
 
-    # handle receiving a new message
-    def receive_notification(self, event):
-        id = event['id']
-        if self.notified_id == id:
-            notified_id = 0
-            return
-
-        m = Message.objects.get(pk=id)
-        self.send_message_to_client("notify", serialize_message(m))
-
-    # send message query set back to the client
-    def send_retrieved_messages(self, qs):
-        mf.update_seen(qs)
+    # don't need to authenticate to connect, only when requesting data
+    async def connect(self):
+        start_sweeper()
+        self.outbox = []
+        self.geoloc = None
+        self.binary = MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", [])
+        await self.accept(MSGPACK_SUBPROTOCOL if self.binary else None)
+        socket_log.event(None, "opened")
+        metrics.socket_opened()
 
-        if qs is not None:
-            result = []
-            for m in qs:
-                m_json = serialize_message(m)
-                if m_json:
-                    result.append(m_json)
-            self.send_message_to_client("retrieve", result)
+    # unsubscribe us from the layer group after we disconnect
+    async def disconnect(self, close_code):
+        socket_log.event(self.scope["user"].username, "closed", code=close_code)
+        metrics.socket_closed()
+        self.unsubscribe()
+        await self.flush_outbox()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.run_protocol(self.handle_frame, text_data, bytes_data)
+
+    # handle receiving a new message, events carrying the serialized message need no db work
+    # so they are forwarded straight from the loop
+    async def receive_notification(self, event):
+        if 'payload' in event:
+            self.handle_notification(event)
+            await self.flush_outbox()
         else:
-            self.send_message_to_client("retrieve", "")
+            await self.run_protocol(self.handle_notification, event)
 
-    # send a data frame to the client
-    def send_message_to_client(self, category, data):
-        if not isinstance(data, str):
-            data = json.dumps(data)
-        print(f"<<[SND][{self.scope['user'].username}]: cat: {category}, data: {data}")
-        self.send(text_data=json.dumps({
-            "category": category,
-            "data": data
-        }))
+    async def receive_notification_batch(self, event):
+        if all('payload' in entry for entry in event['messages']):
+            self.handle_notification_batch(event)
+            await self.flush_outbox()
+        else:
+            await self.run_protocol(self.handle_notification_batch, event)
+
+    # run a protocol handler off the loop, then perform the effects it queued
+    async def run_protocol(self, handler, *args):
+        await run_in_db_executor(handler, *args)
+        await self.flush_outbox()
+
+    # perform queued socket / channel layer effects in order
+    async def flush_outbox(self):
+        outbox, self.outbox = self.outbox, []
+        for effect, effect_args in outbox:
+            await effect(*effect_args)
+
+    def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            self.outbox.append((self.send, (None, frame)))
+        else:
+            self.outbox.append((self.send, (frame,)))
 
+    def close_socket(self):
+        self.outbox.append((self.close, ()))
 
-def authenticate_token(token):
-    print("authenticating token...")
-    try:
-        valid_data = VerifyAuthTokenSerializer().validate({"token": token})
-        return valid_data['user']
-    except:
-        raise TokenError("Invalid access token")
+    def join_group(self, group):
+        metrics.group_joined(group, self.channel_name)
+        self.outbox.append((self.channel_layer.group_add, (group, self.channel_name)))
 
+    def leave_group(self, group):
+        metrics.group_left(group, self.channel_name)
+        self.outbox.append((self.channel_layer.group_discard, (group, self.channel_name)))
 
+    def send_group(self, group, event):
+        self.outbox.append((self.channel_layer.group_send, (group, event)))
 
+    def notify_group(self, group, notification):
+        self.outbox.append((notify_batcher.add, (self.channel_layer, group, notification)))
@@ -0,0 +1,145 @@
+# websocket frame encoding
+# protocol v1 frames carry data as a JSON string inside the JSON envelope, so clients parse twice.
+# v2 frames (negotiated at authentication) embed data as a native JSON value and are encoded in one pass,
+# with orjson when it is installed and the stdlib json module otherwise.
+# sockets opened with the drop.msgpack subprotocol use binary MessagePack frames instead, with the category and
+# the field names of requests and responses replaced by small integer tags
+
+import json
+
+import msgpack
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+PROTOCOL_VERSIONS = (1, 2)
+MSGPACK_SUBPROTOCOL = "drop.msgpack"
+
+# tags are part of the wire format, only ever append to these
+CATEGORY_TAGS = {
+	"socket": 0, "post": 1, "retrieve": 2, "vote": 3, "error": 4, "token": 5, "notify": 6, "single": 7,
+	"stubs": 8, "page": 9, "cells": 10, "geoloc": 11, "batch": 12,
+	"notify_batch": 13
+}
+FIELD_TAGS = {
+	"category": 0, "data": 1, "token": 2, "lat": 3, "long": 4, "page": 5, "cursor": 6, "level": 7, "version": 8,
+	"id": 9, "author": 10, "date": 11, "message": 12, "votes": 13, "seen": 14, "distance": 15, "echo": 16,
+	"result": 17, "meta": 18, "success": 19, "messages": 20, "cell": 21, "latest": 22, "centre": 23
+}
+FIELD_NAMES = {tag: name for name, tag in FIELD_TAGS.items()}
+
+
+# JSON text that was already encoded, e.g. a cached blob or a notify payload, embedded as is in v2 frames.
+# it is still a str so v1 frames send it as the data string like before. Binary frames take its tagged MessagePack
+# form, packed on first use and kept with it (or passed in by whoever packed the data already)
+class Encoded(str):
+	def __new__(cls, text, packed=None):
+		encoded = super().__new__(cls, text)
+		encoded._packed = packed
+		encoded._items = None  # the items of an encoded_array, packed one by one instead of parsing the array
+		return encoded
+
+	def msgpack(self):
+		if self._packed is None:
+			if self._items is not None:
+				self._packed = _array_header(len(self._items)) + b"".join(_pack(item) for item in self._items)
+			else:
+				self._packed = pack_data(json.loads(self))
+		return self._packed
+
+
+if orjson is not None:
+	def dumps(obj):
+		return orjson.dumps(obj).decode()
+else:
+	def dumps(obj):
+		return json.dumps(obj, separators=(",", ":"))
+
+
+def parse_version(version):
+	try:
+		version = int(version)
+	except (TypeError, ValueError):
+		return 1
+	return version if version in PROTOCOL_VERSIONS else 1
+
+
+def encode_frame(category, data, version=1):
+	if version >= 2:
+		if isinstance(data, Encoded):
+			return f'{{"category":{dumps(category)},"data":{data}}}'
+		return dumps({"category": category, "data": data})
+
+	if not isinstance(data, str):
+		data = json.dumps(data)
+	return json.dumps({
+		"category": category,
+		"data": data
+	})
+
+
+# data of a batch reply, the results of its requests in order as {category, data} objects with data embedded
+# as a plain JSON value (already encoded data as is)
+def batch_data(results):
+	return Encoded("[" + ",".join(
+		f'{{"category":{dumps(category)},"data":{data if isinstance(data, Encoded) else dumps(data)}}}'
+		for category, data in results
+	) + "]")
+
+
+# a JSON array of already encoded items and plain values, packed from the items' packed forms
+def encoded_array(items):
+	array = Encoded("[" + ",".join(item if isinstance(item, Encoded) else dumps(item) for item in items) + "]")
+	array._items = items
+	return array
+
+
+# replace known field names with their tags, all the way down
+def _tag_fields(data):
+	if isinstance(data, dict):
+		return {FIELD_TAGS.get(key, key): _tag_fields(value) for key, value in data.items()}
+	if isinstance(data, list):
+		return [_tag_fields(value) for value in data]
+	return data
+
+
+# data as tagged MessagePack, e.g. to pass along with its JSON in an Encoded
+def pack_data(data):
+	return msgpack.packb(_tag_fields(data), use_bin_type=True)
+
+
+def _pack(data):
+	return data.msgpack() if isinstance(data, Encoded) else pack_data(data)
+
+
+def _array_header(length):
+	return msgpack.Packer().pack_array_header(length)
+
+
+# a binary frame [category tag, data], assembled from packed parts so Encoded data isn't parsed again
+def encode_msgpack_frame(category, data):
+	return _array_header(2) + msgpack.packb(CATEGORY_TAGS.get(category, category)) + _pack(data)
+
+
+# a binary batch reply [batch tag, [[category tag, data], ...]], each result shaped like a frame
+def encode_msgpack_batch(results):
+	return (_array_header(2) + msgpack.packb(CATEGORY_TAGS["batch"]) + _array_header(len(results))
+		+ b"".join(encode_msgpack_frame(category, data) for category, data in results))
+
+
+# a binary request, a map keyed by field tags (or names) like the JSON requests
+def decode_msgpack_request(bytes_data):
+	request = _name_fields(msgpack.unpackb(bytes_data, raw=False, strict_map_key=False))
+
+	# the requests of a batch (category 20) are tagged maps too
+	if request.get("category") == 20 and isinstance(request.get("data"), list):
+		request["data"] = [_name_fields(batched) for batched in request["data"]]
+	return request
+
+
+def _name_fields(request):
+	if not isinstance(request, dict):
+		raise ValueError("Invalid request")
+	return {FIELD_NAMES.get(key, key): value for key, value in request.items()}
@@ -0,0 +1,26 @@
+# bounded thread pool for running blocking db work from async consumers
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+from .constants import DB_EXECUTOR_WORKERS
+
+
+# every worker thread holds its own db connection, so the pool size caps connections per process
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="drop-db")
+
+
+def _run_with_connection(fn, args, kwargs):
+	close_old_connections()
+	try:
+		return fn(*args, **kwargs)
+	finally:
+		close_old_connections()
+
+
+# await a blocking call on the db executor
+async def run_in_db_executor(fn, *args, **kwargs):
+	loop = asyncio.get_event_loop()
+	return await loop.run_in_executor(db_executor, functools.partial(_run_with_connection, fn, args, kwargs))
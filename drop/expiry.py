@@ -0,0 +1,106 @@
+# message expiry sweeper
+# messages expire MESSAGE_TTL_HOURS after they are posted. Queries only serve live messages
+# (Message.objects.live()), expired rows are deleted here in bounded batches in expires order, off the
+# (expires) index, and everything derived from them (cell totals, stubs, cached pages) is updated
+
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection, close_old_connections, transaction
+from django.utils.timezone import now
+from drop.models import Message
+from .constants import EXPIRY_SWEEP_INTERVAL, EXPIRY_SWEEP_BATCH, EXPIRY_SWEEP_MAX_BATCHES
+from .votes import supports_returning
+from . import page_cache, cell_aggregates, stub_index, message_cache, socket_log
+
+_lock = threading.Lock()
+_counters = {"runs": 0, "swept": 0, "last_swept": 0, "last_run_ms": 0.0}
+_sweeper = None
+
+
+# sweep counters for this process
+def stats():
+	with _lock:
+		return dict(_counters)
+
+
+# delete up to batch expired messages, returns (id, cell, votes, author_id) of the deleted rows
+def _delete_batch(batch):
+	cutoff = now()
+	if supports_returning():
+		table = connection.ops.quote_name(Message._meta.db_table)
+		expires = connection.ops.adapt_datetimefield_value(cutoff)
+
+		# sweepers in other processes skip the rows we hold instead of deleting them twice
+		lock = " FOR UPDATE SKIP LOCKED" if connection.vendor == "postgresql" else ""
+		with connection.cursor() as cursor:
+			cursor.execute(
+				f"DELETE FROM {table} WHERE id IN ("
+				f"SELECT id FROM {table} WHERE expires <= %s ORDER BY expires LIMIT %s{lock}"
+				f") RETURNING id, cell, votes, author_id",
+				[expires, batch]
+			)
+			return cursor.fetchall()
+
+	with transaction.atomic():
+		rows = list(Message.objects.filter(expires__lte=cutoff).order_by('expires').values_list('id', 'cell', 'votes', 'author_id')[:batch])
+		Message.objects.filter(pk__in=[row[0] for row in rows]).delete()
+		return rows
+
+
+# delete expired messages batch by batch until none are left or max_batches ran, returns the number deleted
+def sweep(batch=EXPIRY_SWEEP_BATCH, max_batches=None):
+	start = time.perf_counter()
+	swept = 0
+	batches = 0
+	while max_batches is None or batches < max_batches:
+		rows = _delete_batch(batch)
+		batches += 1
+		swept += len(rows)
+
+		aggregates = defaultdict(lambda: [0, 0, None])
+		scopes = set()
+		for msg_id, cell, votes, author_id in rows:
+			aggregates[cell][0] -= 1
+			aggregates[cell][1] -= votes
+			stub_index.remove(cell, msg_id)
+			scopes.add(page_cache.block_scope(cell))
+			scopes.add(page_cache.user_scope(author_id))
+		cell_aggregates.record(aggregates)
+		page_cache.invalidate(*scopes)
+		message_cache.invalidate([row[0] for row in rows])
+
+		if len(rows) < batch:
+			break
+
+	with _lock:
+		_counters["runs"] += 1
+		_counters["swept"] += swept
+		_counters["last_swept"] = swept
+		_counters["last_run_ms"] = round((time.perf_counter() - start) * 1000, 3)
+	return swept
+
+
+def _run_sweeper():
+	while True:
+		close_old_connections()
+		try:
+			swept = sweep(max_batches=EXPIRY_SWEEP_MAX_BATCHES)
+			if swept:
+				socket_log.task("expiry", "swept", messages=swept)
+		except Exception as e:
+			socket_log.task("expiry", "sweep failed", error=e)
+		finally:
+			close_old_connections()
+		time.sleep(EXPIRY_SWEEP_INTERVAL)
+
+
+# start the background sweeper once per process
+def start_sweeper():
+	global _sweeper
+	if _sweeper is None:
+		with _lock:
+			if _sweeper is None:
+				_sweeper = threading.Thread(target=_run_sweeper, name="drop-expiry-sweeper", daemon=True)
+				_sweeper.start()
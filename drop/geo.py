@@ -0,0 +1,158 @@
+# integer geoblock cell keys
+# a block's lat / long indexes (degrees rounded at GEOLOC_RESOLUTION, shifted to be non negative) are bit
+# interleaved into a Z-order key. Nearby blocks share key prefixes, so one index on the key answers block
+# equality and a box of blocks is a handful of contiguous key ranges.
+# Dropping the low 2 * level bits of a key gives the cell containing it at a coarser level of the hierarchy,
+# each level doubles the side of a cell (level 0 is a block)
+
+from .constants import GEOLOC_RESOLUTION, GEOLOC_LEVELS, CELL_MAX_RANGES, CELL_COVER_QUADS
+
+SCALE = 10 ** GEOLOC_RESOLUTION  # block indexes per degree
+CELL_BITS = (360 * SCALE).bit_length()  # bits per axis
+LAT_INDEX_MAX = 180 * SCALE
+LONG_INDEX_MAX = 360 * SCALE
+
+
+def lat_index(lat):
+	return int(round(lat * SCALE)) + 90 * SCALE
+
+
+def long_index(long):
+	return int(round(long * SCALE)) + 180 * SCALE
+
+
+# degrees of the block at a lat / long index, the inverse of lat_index / long_index
+def index_lat(lat_idx):
+	return round((lat_idx - 90 * SCALE) / SCALE, GEOLOC_RESOLUTION)
+
+
+def index_long(long_idx):
+	return round((long_idx - 180 * SCALE) / SCALE, GEOLOC_RESOLUTION)
+
+
+# whole blocks within a distance in degrees
+def blocks_in(degrees):
+	return int(degrees * SCALE + 1e-9)
+
+
+# degree bounds of an inclusive block index range, widened by half a block on both sides.
+# origin is the index of 0 degrees on the axis
+def index_bounds(lo, hi, origin):
+	return (lo - origin - 0.5) / SCALE, (hi - origin + 0.5) / SCALE
+
+
+# spread the bits of x apart so another axis can be interleaved between them
+def _spread(x):
+	result = 0
+	for bit in range(CELL_BITS):
+		result |= ((x >> bit) & 1) << (2 * bit)
+	return result
+
+
+def _compact(x):
+	result = 0
+	for bit in range(CELL_BITS):
+		result |= ((x >> (2 * bit)) & 1) << bit
+	return result
+
+
+# Z-order key of the block at the lat / long indexes
+def cell_key(lat_idx, long_idx):
+	return (_spread(lat_idx) << 1) | _spread(long_idx)
+
+
+# (lat index, long index) of a cell key
+def cell_indexes(cell):
+	return _compact(cell >> 1), _compact(cell)
+
+
+# key of the cell at the level containing a block's cell
+def parent_cell(cell, level):
+	return cell >> (2 * level)
+
+
+# inclusive range of block cell keys inside the cell at the level
+def child_range(key, level):
+	return key << (2 * level), ((key + 1) << (2 * level)) - 1
+
+
+# keys of the cell at the level and the cells around it, radius cells out
+def neighbour_cells(key, level, radius=1):
+	lat_idx, long_idx = cell_indexes(key)
+	lat_max, long_max = LAT_INDEX_MAX >> level, LONG_INDEX_MAX >> level
+	return [
+		cell_key(lat_idx + d_lat, long_idx + d_long)
+		for d_lat in range(-radius, radius + 1)
+		for d_long in range(-radius, radius + 1)
+		if 0 <= lat_idx + d_lat <= lat_max and 0 <= long_idx + d_long <= long_max
+	]
+
+
+# (lat, long) of the centre of the cell at the level
+def cell_centre(key, level):
+	lat_idx, long_idx = cell_indexes(key)
+	offset = ((1 << level) - 1) / 2
+	return (
+		((lat_idx << level) + offset - lat_index(0)) / SCALE,
+		((long_idx << level) + offset - long_index(0)) / SCALE
+	)
+
+
+def parse_level(level):
+	try:
+		return min(max(int(level), 0), GEOLOC_LEVELS)
+	except (TypeError, ValueError):
+		return 0
+
+
+# inclusive (lo, hi) cell key ranges covering every block in the inclusive index box.
+# returns (ranges, exact), when more than max_ranges are needed the closest ranges are merged and the
+# cover is no longer exact (it takes in blocks outside the box too). The walk costs about the box's perimeter
+# in quads, so a box longer than CELL_COVER_QUADS blocks around takes in the quads on its edge whole at the
+# level where there are about that many of them, instead of splitting them down to blocks
+def cell_ranges(lat_lo, lat_hi, long_lo, long_hi, max_ranges=CELL_MAX_RANGES):
+	ranges = []
+	perimeter = 2 * (max(0, lat_hi - lat_lo + 1) + max(0, long_hi - long_lo + 1))
+	coarse = (perimeter // CELL_COVER_QUADS).bit_length()
+	partial = []  # set once a quad on the edge is taken in whole
+
+	# walk the implicit quadtree in key order, quads are (1 << level) blocks a side
+	def visit(prefix, level, lat0, long0):
+		size = 1 << level
+		lat1, long1 = lat0 + size - 1, long0 + size - 1
+		if lat1 < lat_lo or lat0 > lat_hi or long1 < long_lo or long0 > long_hi:
+			return
+
+		inside = lat_lo <= lat0 and lat1 <= lat_hi and long_lo <= long0 and long1 <= long_hi
+		if inside or level <= coarse:
+			if not inside:
+				partial.append(prefix)
+			lo = prefix << (2 * level)
+			hi = lo + (1 << (2 * level)) - 1
+			if ranges and ranges[-1][1] + 1 == lo:
+				ranges[-1][1] = hi
+			else:
+				ranges.append([lo, hi])
+			return
+
+		half = level - 1
+		for quad in range(4):
+			visit((prefix << 2) | quad, half, lat0 + ((quad >> 1) << half), long0 + ((quad & 1) << half))
+
+	if lat_lo <= lat_hi and long_lo <= long_hi:
+		visit(0, CELL_BITS, 0, 0)
+
+	exact = len(ranges) <= max_ranges and not partial
+	if len(ranges) > max_ranges:
+		# close the smallest gaps between consecutive ranges
+		gaps = sorted(range(len(ranges) - 1), key=lambda i: ranges[i + 1][0] - ranges[i][1])
+		closed = set(gaps[:len(ranges) - max_ranges])
+		merged = [ranges[0]]
+		for i in range(1, len(ranges)):
+			if i - 1 in closed:
+				merged[-1][1] = ranges[i][1]
+			else:
+				merged.append(ranges[i])
+		ranges = merged
+
+	return [tuple(r) for r in ranges], exact
@@ -0,0 +1,117 @@
+# seeded benchmark datasets, shared by the bench_* management commands
+
+import os
+import random
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils.timezone import now
+from drop.constants import MESSAGE_TTL_HOURS
+from drop.models import Message, message_hash, hot_score
+from drop.util import Geoloc
+from drop import seen_counter, cell_aggregates, votes
+
+BATCH_SIZE = 5000
+BLOCK_SIZE = 0.01  # degrees, a geoblock at GEOLOC_RESOLUTION 2
+
+
+# run against a throwaway copy of the database so benchmarks never touch real data.
+# concurrent benchmarks pass concurrent=True: sqlite's shared in memory test database locks whole tables
+# between connections, so sqlite gets a test database file instead. Seen counts, cell totals and votes the
+# benchmark left buffered are dropped before switching back, their flushers (and atexit) would write them
+# to the real database
+@contextmanager
+def test_database(verbosity=0, concurrent=False):
+	old_name = connection.settings_dict["NAME"]
+	test_settings = connection.settings_dict.setdefault("TEST", {})
+	old_test_name = test_settings.get("NAME")
+	if concurrent and connection.vendor == "sqlite" and not old_test_name:
+		test_settings["NAME"] = os.path.join(tempfile.gettempdir(), "drop_bench.sqlite3")
+	connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+	try:
+		yield
+	finally:
+		seen_counter.discard()
+		cell_aggregates.discard()
+		votes.discard()
+		connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+		test_settings["NAME"] = old_test_name
+
+
+def add_arguments(parser):
+	parser.add_argument("--users", type=int, default=100, help="users to seed")
+	parser.add_argument("--messages", type=int, default=10000, help="messages to seed")
+	parser.add_argument("--blocks", type=int, default=100, help="geoblocks the messages are spread over")
+	parser.add_argument("--distribution", choices=["uniform", "zipf"], default="zipf",
+		help="uniform spreads messages evenly over the blocks, zipf piles them into a few hot blocks")
+	parser.add_argument("--origin", type=float, nargs=2, default=[-33.87, 151.21], metavar=("LAT", "LONG"),
+		help="corner of the square grid of blocks")
+	parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+
+# geolocations of the centre of the seeded blocks, a square grid starting at the origin
+def block_centres(options):
+	side = max(1, int(options["blocks"] ** 0.5 + 0.999))
+	lat, long = options["origin"]
+	return [
+		Geoloc(lat + (i // side) * BLOCK_SIZE, long + (i % side) * BLOCK_SIZE).get_block()
+		for i in range(options["blocks"])
+	]
+
+
+# weights of the blocks under the distribution, block 0 is the hottest
+def block_weights(options):
+	if options["distribution"] == "zipf":
+		return [1 / (i + 1) for i in range(options["blocks"])]
+	return [1] * options["blocks"]
+
+
+# seed users and messages, returns the users
+def seed(options, stdout=None):
+	rng = random.Random(options["seed"])
+
+	# bulk_create doesn't hand back primary keys on every backend, read the users back
+	User.objects.bulk_create([User(username=f"bench{i}") for i in range(options["users"])], batch_size=BATCH_SIZE)
+	users = list(User.objects.filter(username__startswith="bench").order_by("id"))
+
+	centres = block_centres(options)
+	weights = block_weights(options)
+	start = now()
+	batch = []
+	for i in range(options["messages"]):
+		block = rng.choices(centres, weights)[0]
+		geoloc = Geoloc(
+			block.lat + rng.uniform(-BLOCK_SIZE / 2, BLOCK_SIZE / 2) * 0.99,
+			block.long + rng.uniform(-BLOCK_SIZE / 2, BLOCK_SIZE / 2) * 0.99
+		)
+		text = f"bench message {i}"
+		batch.append(seeded_message(geoloc, text, rng.choice(users),
+			date=start - timedelta(seconds=rng.uniform(0, 48 * 3600)),
+			votes=int(rng.expovariate(0.3)) - 1,
+			seen=rng.randint(0, 500)
+		))
+
+		if len(batch) >= BATCH_SIZE:
+			Message.objects.bulk_create(batch)
+			batch = []
+			if stdout:
+				stdout.write(f"seeded {i + 1} messages")
+	Message.objects.bulk_create(batch)
+
+	return users
+
+
+# an unsaved message with the derived columns save() would fill in, for bulk_create
+def seeded_message(geoloc, text, author, **fields):
+	block = geoloc.get_block()
+	if "date" in fields:
+		fields.setdefault("expires", fields["date"] + timedelta(hours=MESSAGE_TTL_HOURS))
+	m = Message(
+		lat=geoloc.lat, long=geoloc.long, lat_block=block.lat, long_block=block.long, cell=block.cell,
+		message=text, content_hash=message_hash(text), author=author, **fields
+	)
+	m.hot = hot_score(m.votes, m.date)
+	return m
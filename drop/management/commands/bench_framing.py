@@ -0,0 +1,84 @@
+# bytes per frame and encode / decode time of the websocket frame encodings
+# python manage.py bench_framing --repeat 10000
+
+import json
+import random
+import time
+from datetime import datetime
+
+import msgpack
+from django.core.management.base import BaseCommand
+from drop import encoding
+from drop.constants import PAGE_SIZE
+
+
+# a serialized message like drop.util.serialize_message produces
+def sample_message(rng, msg_id):
+	return {
+		"id": msg_id,
+		"author": f"user{rng.randint(1, 1000)}",
+		"lat": round(-33.87 + rng.uniform(-0.005, 0.005), 6),
+		"long": round(151.21 + rng.uniform(-0.005, 0.005), 6),
+		"date": datetime.now().strftime("%d/%m/%Y"),
+		"message": " ".join(rng.choice(["drop", "here", "coffee", "view", "great", "the", "a"]) for _ in range(rng.randint(3, 20))),
+		"votes": rng.randint(-5, 50),
+		"seen": rng.randint(0, 500)
+	}
+
+
+def sample_frames(rng):
+	page = [sample_message(rng, 1000 + i) for i in range(PAGE_SIZE)]
+	stubs = {"id": list(range(200)), "lat": [m["lat"] for m in page] * 20, "long": [m["long"] for m in page] * 20}
+	return [
+		("retrieve page", "retrieve", page),
+		("notify", "notify", encoding.Encoded(json.dumps(page[0]))),
+		("vote", "vote", {"id": 1000, "success": True, "meta": "12"}),
+		("stubs x200", "stubs", encoding.Encoded(json.dumps(stubs, separators=(",", ":"))))
+	]
+
+
+# how a client reads each encoding
+def decode_v1(frame):
+	envelope = json.loads(frame)
+	return json.loads(envelope["data"])
+
+
+def decode_v2(frame):
+	return json.loads(frame)
+
+
+def decode_msgpack(frame):
+	return msgpack.unpackb(frame, raw=False, strict_map_key=False)
+
+
+class Command(BaseCommand):
+	help = "Compare bytes per frame and encode / decode time of JSON v1, JSON v2 and msgpack frames"
+
+	def add_arguments(self, parser):
+		parser.add_argument("--repeat", type=int, default=10000, help="timed encodes / decodes of each frame")
+		parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+	def handle(self, *args, **options):
+		repeat = options["repeat"]
+		encodings = [
+			("json v1", lambda c, d: encoding.encode_frame(c, d, 1), decode_v1),
+			("json v2", lambda c, d: encoding.encode_frame(c, d, 2), decode_v2),
+			("msgpack", encoding.encode_msgpack_frame, decode_msgpack),
+		]
+		self.stdout.write(f"json v2 encoder: {'orjson' if encoding.orjson is not None else 'stdlib json'}")
+
+		for name, category, data in sample_frames(random.Random(options["seed"])):
+			self.stdout.write(self.style.MIGRATE_HEADING(f"\n{name}"))
+			for encoding_name, encode, decode in encodings:
+				frame = encode(category, data)
+				encode_us = self.timed(repeat, lambda: encode(category, data))
+				decode_us = self.timed(repeat, lambda: decode(frame))
+				self.stdout.write(self.style.SUCCESS(
+					f"{encoding_name}: {len(frame)} bytes, encode {encode_us:.2f} us, decode {decode_us:.2f} us"
+				))
+
+	def timed(self, repeat, fn):
+		start = time.perf_counter()
+		for _ in range(repeat):
+			fn()
+		return (time.perf_counter() - start) / repeat * 1e6
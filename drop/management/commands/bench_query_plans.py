@@ -0,0 +1,61 @@
+# query plans and timings of the message listings with and without the listing indexes
+# python manage.py bench_query_plans --messages 100000 --blocks 100
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from drop.constants import PAGE_SIZE
+from drop.models import Message
+from . import _seed
+
+
+class Command(BaseCommand):
+	help = "Seed a throwaway database and show message listing query plans before and after the listing indexes"
+
+	def add_arguments(self, parser):
+		_seed.add_arguments(parser)
+		parser.add_argument("--repeat", type=int, default=20, help="timed runs of each query")
+
+	def handle(self, *args, **options):
+		with _seed.test_database():
+			users = _seed.seed(options, self.stdout)
+			self.stdout.write(f"seeded {options['messages']} messages in {options['blocks']} blocks ({options['distribution']})")
+
+			queries = self.listing_queries(_seed.block_centres(options)[0], users[0])
+			indexes = Message._meta.indexes
+
+			with connection.schema_editor() as schema_editor:
+				for index in indexes:
+					schema_editor.remove_index(Message, index)
+			self.report("BEFORE (no listing indexes)", queries, options["repeat"])
+
+			with connection.schema_editor() as schema_editor:
+				for index in indexes:
+					schema_editor.add_index(Message, index)
+			self.report("AFTER", queries, options["repeat"])
+
+	# the querysets message_facade runs for a page of each listing, in the hottest block
+	def listing_queries(self, block, user):
+		# the listings only show live messages, like drop/message_facade.py
+		in_block = Message.objects.live().filter(cell=block.cell)
+		deep = 50 * PAGE_SIZE
+		return [
+			("ranked page 1", in_block.order_by('-votes', '-id')[:PAGE_SIZE]),
+			("ranked page 51", in_block.order_by('-votes', '-id')[deep:deep + PAGE_SIZE]),
+			("new page 1", in_block.order_by('-date', '-id')[:PAGE_SIZE]),
+			("new page 51", in_block.order_by('-date', '-id')[deep:deep + PAGE_SIZE]),
+			("hot page 1", in_block.order_by('-hot', '-id')[:PAGE_SIZE]),
+			("user page 1", Message.objects.live().filter(author_id=user.pk).order_by('-date', '-id')[:PAGE_SIZE]),
+		]
+
+	def report(self, title, queries, repeat):
+		self.stdout.write(self.style.MIGRATE_HEADING(f"\n{title}"))
+		for name, qs in queries:
+			start = time.perf_counter()
+			for _ in range(repeat):
+				list(qs.all())
+			elapsed = (time.perf_counter() - start) / repeat * 1000
+
+			self.stdout.write(self.style.SUCCESS(f"{name}: {elapsed:.2f} ms"))
+			self.stdout.write(qs.explain())
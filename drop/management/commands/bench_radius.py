@@ -0,0 +1,62 @@
+# timings of the km radius search over a large seeded dataset
+# python manage.py bench_radius --messages 1000000 --blocks 10000
+
+import math
+import time
+
+from django.core.management.base import BaseCommand
+from drop import nearby
+from . import _seed
+
+
+# the per row distance the numpy pass replaces
+def python_haversine_km(lat, long, lats, longs):
+	lat, long = math.radians(lat), math.radians(long)
+	result = []
+	for other_lat, other_long in zip(lats.tolist(), longs.tolist()):
+		other_lat, other_long = math.radians(other_lat), math.radians(other_long)
+		a = math.sin((other_lat - lat) / 2) ** 2 + math.cos(lat) * math.cos(other_lat) * math.sin((other_long - long) / 2) ** 2
+		result.append(2 * nearby.EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+	return result
+
+
+class Command(BaseCommand):
+	help = "Seed a throwaway database and time radius searches: candidate fetch, distance pass and first page"
+
+	def add_arguments(self, parser):
+		_seed.add_arguments(parser)
+		parser.set_defaults(messages=1000000, blocks=10000, distribution="uniform")
+		parser.add_argument("--radius", type=float, nargs="+", default=[0.5, 1, 5, 10, 25], help="radii in km to search")
+		parser.add_argument("--repeat", type=int, default=5, help="timed runs of each search")
+
+	def handle(self, *args, **options):
+		with _seed.test_database():
+			_seed.seed(options, self.stdout)
+			self.stdout.write(f"seeded {options['messages']} messages in {options['blocks']} blocks ({options['distribution']})")
+
+			# search from the middle of the seeded grid
+			centres = _seed.block_centres(options)
+			lat = sum(c.lat for c in centres) / len(centres)
+			long = sum(c.long for c in centres) / len(centres)
+
+			for radius_km in options["radius"]:
+				self.report(lat, long, radius_km, options["repeat"])
+
+	def report(self, lat, long, radius_km, repeat):
+		self.stdout.write(self.style.MIGRATE_HEADING(f"\nradius {radius_km} km"))
+		q = nearby.in_boxes(nearby.index_boxes(lat, long, radius_km))
+		ids, lats, longs = nearby.candidates(q)
+		found, _ = nearby.within(lat, long, radius_km)
+		self.stdout.write(f"{len(ids)} candidates, {len(found)} within radius")
+
+		self.timed("candidate fetch", repeat, lambda: nearby.candidates(q))
+		self.timed("numpy distance pass", repeat, lambda: nearby.within_candidates(lat, long, radius_km, ids, lats, longs))
+		self.timed("python distance pass", repeat, lambda: python_haversine_km(lat, long, lats, longs))
+		self.timed("whole search + first page", repeat, lambda: nearby.new_feed(lat, long, radius_km).page(1))
+
+	def timed(self, name, repeat, fn):
+		start = time.perf_counter()
+		for _ in range(repeat):
+			fn()
+		elapsed = (time.perf_counter() - start) / repeat * 1000
+		self.stdout.write(self.style.SUCCESS(f"{name}: {elapsed:.2f} ms"))
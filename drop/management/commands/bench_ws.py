@@ -0,0 +1,205 @@
+# websocket load test, simulated clients replay a mix of request categories against the ASGI application
+# python manage.py bench_ws --clients 50 --ops 200 --json bench.json
+# python manage.py bench_ws --clients 50 --ops 200 --baseline bench.json  (fails on a regression)
+
+import asyncio
+import json
+import logging
+import random
+import time
+
+import numpy as np
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework_jwt.settings import api_settings
+from drop import metrics
+from drop.models import Message
+from dropmessages.routing import application
+from . import _seed
+
+# category of the response each request code is answered with
+RESPONSES = {0: "post", 1: "geoloc", 2: "retrieve", 3: "retrieve", 4: "retrieve", 5: "retrieve", 6: "retrieve",
+	7: "vote", 8: "vote", 12: "single", 13: "stubs"}
+DEFAULT_MIX = "0:1,1:1,2:4,3:4,4:1,5:1,6:1,7:2,8:1,12:2,13:2"
+IN_MEMORY_LAYER = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def parse_mix(mix):
+	weights = {}
+	for item in mix.split(","):
+		code, weight = item.split(":")
+		if int(code) not in RESPONSES:
+			raise CommandError(f"category {code} can't be benchmarked, use one of {sorted(RESPONSES)}")
+		weights[int(code)] = float(weight)
+	return weights
+
+
+def token(user):
+	return api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(user))
+
+
+class Client:
+	def __init__(self, application, path, user, rng, options):
+		self.communicator = WebsocketCommunicator(application, path)
+		self.user = user
+		self.rng = rng
+		self.options = options
+		self.frames = 0  # every frame received, responses and notifications
+		self.latencies = {}  # request code -> seconds
+
+	async def receive(self, category):
+		while True:
+			frame = json.loads(await self.communicator.receive_from(self.options["timeout"]))
+			self.frames += 1
+			if frame["category"] in ("error", "token"):
+				raise CommandError(f"{self.user.username} got {frame['category']}: {frame['data']}")
+			if frame["category"] == category:
+				return frame
+
+	async def connect(self, block):
+		connected, _ = await self.communicator.connect(self.options["timeout"])
+		if not connected:
+			raise CommandError("websocket connection refused")
+		await self.communicator.send_to(text_data=json.dumps({
+			"category": 11, "token": token(self.user), "lat": block.lat, "long": block.long,
+			"version": self.options["protocol_version"]
+		}))
+		await self.receive("socket")
+
+	def request(self, code, n, blocks, weights, ids):
+		request = {"category": code}
+		if code == 0:
+			request["data"] = f"bench {self.user.username} op {n}"
+		elif code == 1:
+			block = self.rng.choices(blocks, weights)[0]
+			request.update(lat=block.lat, long=block.long)
+		elif code in (2, 3):
+			request["page"] = self.rng.randint(1, 3)
+		elif code in (4, 6):
+			request["page"] = 1
+		elif code == 5:
+			request.update(page=1, data=0.02)
+		elif code in (7, 8, 12):
+			request["data"] = self.rng.choice(ids)
+		return request
+
+	async def run(self, mix, blocks, weights, ids):
+		codes, code_weights = list(mix), list(mix.values())
+		for n in range(self.options["ops"]):
+			code = self.rng.choices(codes, code_weights)[0]
+			request = json.dumps(self.request(code, n, blocks, weights, ids))
+			start = time.perf_counter()
+			await self.communicator.send_to(text_data=request)
+			await self.receive(RESPONSES[code])
+			self.latencies.setdefault(code, []).append(time.perf_counter() - start)
+		await self.communicator.disconnect()
+
+
+class Command(BaseCommand):
+	help = "Seed a throwaway database and load test the websocket api with simulated clients on an in memory channel layer"
+
+	def add_arguments(self, parser):
+		_seed.add_arguments(parser)
+		parser.add_argument("--clients", type=int, default=20, help="simulated clients connected at once")
+		parser.add_argument("--ops", type=int, default=100, help="requests each client makes")
+		parser.add_argument("--mix", default=DEFAULT_MIX, help="request codes and their weights, code:weight,...")
+		parser.add_argument("--path", default="/ws/", help="websocket endpoint, e.g. /ws/sync/ or /ws/async/")
+		parser.add_argument("--protocol-version", type=int, default=1, help="protocol version the clients negotiate")
+		parser.add_argument("--timeout", type=float, default=10, help="seconds to wait for a response")
+		parser.add_argument("--json", help="write the results to this file")
+		parser.add_argument("--baseline", help="results file of an earlier run, fail if this run regressed")
+		parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p99 and queries per op increase over the baseline")
+
+	def handle(self, *args, **options):
+		mix = parse_mix(options["mix"])
+
+		# the frame log writer would interleave with the report, frames are still counted
+		logging.getLogger("drop.socket").disabled = True
+
+		with _seed.test_database(concurrent=True), override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+			users = _seed.seed(options, self.stdout)
+			self.stdout.write(f"seeded {options['messages']} messages in {options['blocks']} blocks ({options['distribution']})")
+
+			results = asyncio.get_event_loop().run_until_complete(self.load(application, users, mix, options))
+
+		self.report(results)
+		if options["json"]:
+			with open(options["json"], "w") as f:
+				json.dump(results, f, indent=2)
+		if options["baseline"]:
+			with open(options["baseline"]) as f:
+				self.compare(results, json.load(f), options["tolerance"])
+
+	async def load(self, application, users, mix, options):
+		blocks = _seed.block_centres(options)
+		weights = _seed.block_weights(options)
+		ids = list(Message.objects.values_list("id", flat=True)) or [0]
+
+		clients = []
+		for i in range(options["clients"]):
+			rng = random.Random(options["seed"] * 1000003 + i)
+			client = Client(application, options["path"], users[i % len(users)], rng, options)
+			await client.connect(rng.choices(blocks, weights)[0])
+			clients.append(client)
+
+		queries_before = metrics.totals("drop_frame_queries")
+		start = time.perf_counter()
+		await asyncio.gather(*[client.run(mix, blocks, weights, ids) for client in clients])
+		elapsed = time.perf_counter() - start
+		queries_after = metrics.totals("drop_frame_queries")
+
+		codes = {}
+		for code in sorted(mix):
+			latencies = [seconds for client in clients for seconds in client.latencies.get(code, [])]
+			if not latencies:
+				continue
+			count, queries = queries_after.get(str(code), (0, 0))
+			before_count, before_queries = queries_before.get(str(code), (0, 0))
+			codes[str(code)] = {
+				"ops": len(latencies),
+				"p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+				"p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+				"queries_per_op": round((queries - before_queries) / max(1, count - before_count), 2)
+			}
+
+		latencies = [seconds for client in clients for code_latencies in client.latencies.values() for seconds in code_latencies]
+		return {
+			"clients": options["clients"],
+			"ops": len(latencies),
+			"seconds": round(elapsed, 3),
+			"ops_per_second": round(len(latencies) / elapsed, 1),
+			"frames_per_second": round(sum(client.frames for client in clients) / elapsed, 1),
+			"p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+			"p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+			"codes": codes
+		}
+
+	def report(self, results):
+		self.stdout.write(self.style.MIGRATE_HEADING(
+			f"\n{results['clients']} clients, {results['ops']} requests in {results['seconds']} s"
+		))
+		for code, result in results["codes"].items():
+			self.stdout.write(
+				f"category {code:>2}: {result['ops']} ops, p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+				f"{result['queries_per_op']} queries/op"
+			)
+		self.stdout.write(self.style.SUCCESS(
+			f"all: p50 {results['p50_ms']:.2f} ms, p99 {results['p99_ms']:.2f} ms, "
+			f"{results['ops_per_second']} ops/s, {results['frames_per_second']} frames/s"
+		))
+
+	def compare(self, results, baseline, tolerance):
+		regressions = []
+		for code, result in results["codes"].items():
+			before = baseline.get("codes", {}).get(code)
+			if before is None:
+				continue
+			if result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+				regressions.append(f"category {code} p99 {before['p99_ms']} -> {result['p99_ms']} ms")
+			if result["queries_per_op"] > before["queries_per_op"] * (1 + tolerance):
+				regressions.append(f"category {code} queries/op {before['queries_per_op']} -> {result['queries_per_op']}")
+
+		if regressions:
+			raise CommandError("regressed against the baseline:\n" + "\n".join(regressions))
+		self.stdout.write(self.style.SUCCESS("no regressions against the baseline"))
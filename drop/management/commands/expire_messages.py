@@ -0,0 +1,18 @@
+# delete every expired message now, e.g. from a scheduled job when the websocket servers' sweepers are off
+# python manage.py expire_messages --batch 1000
+
+from django.core.management.base import BaseCommand
+from drop import expiry
+from drop.constants import EXPIRY_SWEEP_BATCH
+
+
+class Command(BaseCommand):
+	help = "Delete expired messages in batches and report how many were swept"
+
+	def add_arguments(self, parser):
+		parser.add_argument("--batch", type=int, default=EXPIRY_SWEEP_BATCH, help="max messages deleted per statement")
+
+	def handle(self, *args, **options):
+		swept = expiry.sweep(batch=options["batch"])
+		stats = expiry.stats()
+		self.stdout.write(self.style.SUCCESS(f"swept {swept} expired messages in {stats['last_run_ms']} ms"))
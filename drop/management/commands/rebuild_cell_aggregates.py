@@ -0,0 +1,16 @@
+# recompute the per cell message totals of the geoblock hierarchy from the messages table
+# python manage.py rebuild_cell_aggregates, with the websocket servers stopped (see cell_aggregates.rebuild)
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from drop import cell_aggregates
+from drop.models import CellAggregate
+
+
+class Command(BaseCommand):
+	help = "Recompute every CellAggregate from the messages table"
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			cell_aggregates.rebuild()
+		self.stdout.write(self.style.SUCCESS(f"rebuilt {CellAggregate.objects.count()} cell aggregates"))
@@ -0,0 +1,36 @@
+# lru cache of serialized messages
+# a message's serialized form only changes with its votes and seen count (the author, text and date are fixed),
+# so entries are stored per id with the votes / seen they were built from and a lookup with other counts misses.
+# writers drop the ids they change so stale forms don't hold on to cache space
+
+import threading
+from collections import OrderedDict
+
+from .constants import MESSAGE_CACHE_MAX
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # msg id -> (votes, seen, serialized message), lru ordered
+
+
+# the serialized message built for these counts, or None
+def get(msg_id, votes, seen):
+	with _lock:
+		entry = _entries.get(msg_id)
+		if entry is None or entry[0] != votes or entry[1] != seen:
+			return None
+		_entries.move_to_end(msg_id)
+		return entry[2]
+
+
+def put(msg_id, votes, seen, serialized):
+	with _lock:
+		_entries[msg_id] = (votes, seen, serialized)
+		_entries.move_to_end(msg_id)
+		while len(_entries) > MESSAGE_CACHE_MAX:
+			_entries.popitem(last=False)
+
+
+def invalidate(msg_ids):
+	with _lock:
+		for msg_id in msg_ids:
+			_entries.pop(msg_id, None)
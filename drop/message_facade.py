@@ -1,25 +1,38 @@
 # facade for handling message data transactions and related logic
 # Jeremy Vun 2726092
 
-from django.contrib.auth.models import User
 from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from drop.models import Message
-from drop.constants import DELETE_THRESH, PAGE_SIZE
-from .util import Geoloc, Stub
+from drop.constants import PAGE_SIZE
+from .util import serialize_messages, encode_cursor, decode_cursor
+from .geo import blocks_in, cell_ranges, index_bounds, lat_index, long_index, LAT_INDEX_MAX, LONG_INDEX_MAX
+from . import page_cache, seen_counter, votes, cell_aggregates, random_feed, nearby, stub_index, message_cache
 
 
-def create_message(geoloc, message, user_id):
+# cache scopes a stored message's pages are cached under
+def _message_scopes(m):
+	return page_cache.block_scope(m.cell), page_cache.user_scope(m.author_id)
+
+
+def create_message(geoloc, message, author):
 	try:
 		if geoloc and geoloc.is_valid() and message:
-			# check for duplicate messages at the same geolocation
 			block = geoloc.get_block()
-			qs = Message.objects.filter(lat_block=block.lat, long_block=block.long, message__iexact=message)
+			m = Message(lat=geoloc.lat, long=geoloc.long, lat_block=block.lat, long_block=block.long, cell=block.cell, message=message, author=author)
+
+			# duplicates at the same geolocation are rejected by the (block, content hash) unique constraint
+			try:
+				with transaction.atomic():
+					m.save()
+			except IntegrityError:
+				return None
 
-			if not qs.exists():
-				user = User.objects.get(pk=user_id)  # get author
-				m = Message(lat=geoloc.lat, long=geoloc.long, lat_block=block.lat, long_block=block.long, message=message, author=user)
-				m.save()
-				return m
+			cell_aggregates.record({m.cell: (1, m.votes, m.date)})
+			stub_index.add(m.cell, m.pk, m.lat, m.long, m.expires)
+			page_cache.invalidate(*_message_scopes(m))
+			return m
 		else:
 			return None
 	except:
@@ -30,10 +43,12 @@ def delete_message(msg_id, user_id):
 	try:
 		msg_id = int(msg_id)
 		m = Message.objects.get(pk=msg_id)
-		print(f"DELETING {m.author.pk} =? {user_id}")
-
-		if m.author.pk == user_id:
+		if m.author_id == user_id:
 			m.delete()
+			cell_aggregates.record({m.cell: (-1, -m.votes, None)})
+			stub_index.remove(m.cell, msg_id)
+			message_cache.invalidate([msg_id])
+			page_cache.invalidate(*_message_scopes(m))
 			return msg_id
 		return None
 	except:
@@ -43,54 +58,64 @@ def delete_message(msg_id, user_id):
 # retrieve a single message only
 def retrieve_single_message(msg_id):
 	try:
-		return Message.objects.get(pk=msg_id)
+		return Message.objects.live().select_related('author').get(pk=msg_id)
 	except:
 		return None
 
 
-# get all messages in geoblock and return as stubs (id, lat, long)
+# stubs (id, lat, long) of every message in the geoblock, as prebuilt JSON from the stub index
 def retrieve_message_stubs(geoloc):
 	try:
 		if geoloc and geoloc.is_valid():
 			block = geoloc.get_block()
-			qs = Message.objects.filter(lat_block=block.lat, long_block=block.long)
+			return stub_index.get_json(block.cell)
+		return None
+	except:
+		return None
+
 
-			result = []
-			for m in qs:
-				result.append(Stub(m.pk, m.lat, m.long))
-			return result
+# pages of the block's messages by votes, shared between every socket in the block
+def retrieve_messages_ranked(geoloc, page_num):
+	try:
+		if geoloc and geoloc.is_valid():
+			block = geoloc.get_block()
+			qs = Message.objects.live().select_related('author').filter(cell=block.cell).order_by('-votes', '-id')
+			return page_cache.get_page(page_cache.block_scope(block.cell), "ranked", page_num, qs)
+		return None
 	except:
 		return None
 
 
-def retrieve_messages_ranked(geoloc):
+# pages of the block's messages by date, shared between every socket in the block
+def retrieve_messages_new(geoloc, page_num):
 	try:
 		if geoloc and geoloc.is_valid():
 			block = geoloc.get_block()
-			qs = Message.objects.filter(lat_block=block.lat, long_block=block.long).order_by('-votes')
-			return Paginator(qs, PAGE_SIZE)
+			qs = Message.objects.live().select_related('author').filter(cell=block.cell).order_by('-date', '-id')
+			return page_cache.get_page(page_cache.block_scope(block.cell), "new", page_num, qs)
 		return None
 	except:
 		return None
 
 
-def retrieve_messages_new(geoloc):
+# pages of the block's messages by hot rank, shared between every socket in the block
+def retrieve_messages_hot(geoloc, page_num):
 	try:
 		if geoloc and geoloc.is_valid():
 			block = geoloc.get_block()
-			qs = Message.objects.filter(lat_block=block.lat, long_block=block.long).order_by('-date')
-			return Paginator(qs, PAGE_SIZE)
+			qs = Message.objects.live().select_related('author').filter(cell=block.cell).order_by('-hot', '-id')
+			return page_cache.get_page(page_cache.block_scope(block.cell), "hot", page_num, qs)
 		return None
 	except:
 		return None
 
 
+# a new random order session over the block's messages, paged like a Paginator
 def retrieve_messages_random(geoloc):
 	try:
 		if geoloc and geoloc.is_valid():
 			block = geoloc.get_block()
-			qs = Message.objects.filter(lat_block=block.lat, long_block=block.long).order_by('?')
-			return Paginator(qs, PAGE_SIZE)
+			return random_feed.new_feed(block.cell)
 		return None
 	except:
 		return None
@@ -100,52 +125,150 @@ def retrieve_messages_range(geoloc, geoloc_range):
 	try:
 		if geoloc and geoloc.is_valid():
 			block = geoloc.get_block()
-			geoloc_min = Geoloc(block.lat - geoloc_range / 2, block.long - geoloc_range)
-			geoloc_max = Geoloc(block.lat + geoloc_range / 2, block.long + geoloc_range)
 
-			qs = Message.objects.filter(lat_block__lte=geoloc_max.lat, lat_block__gte=geoloc_min.lat, long_block__lte=geoloc_max.long, long_block__gte=geoloc_min.long)
+			# the box in whole blocks around ours, its blocks are a few contiguous cell key ranges
+			lat_c, long_c = lat_index(block.lat), long_index(block.long)
+			lat_reach, long_reach = blocks_in(geoloc_range / 2), blocks_in(geoloc_range)
+			lat_lo, lat_hi = max(0, lat_c - lat_reach), min(LAT_INDEX_MAX, lat_c + lat_reach)
+			long_lo, long_hi = max(0, long_c - long_reach), min(LONG_INDEX_MAX, long_c + long_reach)
+			ranges, exact = cell_ranges(lat_lo, lat_hi, long_lo, long_hi)
+			in_ranges = Q()
+			for lo, hi in ranges:
+				in_ranges |= Q(cell__range=(lo, hi))
+			qs = Message.objects.live().select_related('author').filter(in_ranges)
+
+			# merged ranges cover blocks outside the box too, filter those out of the scanned rows.
+			# bounds sit half a block outside the edge blocks so float rounding can't drop them
+			if not exact:
+				lat_min, lat_max = index_bounds(lat_lo, lat_hi, lat_index(0))
+				long_min, long_max = index_bounds(long_lo, long_hi, long_index(0))
+				qs = qs.filter(lat_block__range=(lat_min, lat_max), long_block__range=(long_min, long_max))
 			return Paginator(qs, PAGE_SIZE)
 		return None
 	except:
 		return None
 
 
-def retrieve_user_messages(user_id):
+# messages within radius_km of the geolocation, nearest first, paged like a Paginator
+def retrieve_messages_radius(geoloc, radius_km):
+	try:
+		if geoloc and geoloc.is_valid():
+			return nearby.new_feed(geoloc.lat, geoloc.long, radius_km)
+		return None
+	except:
+		return None
+
+
+# the k messages nearest the geolocation, nearest first, paged like a Paginator
+def retrieve_messages_nearest(geoloc, k):
+	try:
+		if geoloc and geoloc.is_valid():
+			return nearby.nearest_feed(geoloc.lat, geoloc.long, k)
+		return None
+	except:
+		return None
+
+
+def retrieve_user_messages(user_id, page_num):
 	try:
 		if user_id and isinstance(user_id, int) and user_id >= 1:
-			user = User.objects.get(pk=user_id)
-			qs = Message.objects.filter(author=user)
-			return Paginator(qs, PAGE_SIZE)
+			qs = Message.objects.live().select_related('author').filter(author_id=user_id).order_by('-date', '-id')
+			return page_cache.get_page(page_cache.user_scope(user_id), "new", page_num, qs)
+	except:
+		return None
+
+
+# keyset page of qs in descending (field, id) order after the cursor, with the cursor for the page after
+def _seek_page(qs, ordering, field, cursor):
+	qs = qs.order_by(f"-{field}", "-id")
+	after = decode_cursor(cursor, ordering)
+	if after:
+		key, last_id = after
+		# the redundant <= bound lets the (block, field) index seek straight to the cursor
+		qs = qs.filter(Q(**{f"{field}__lt": key}) | Q(**{field: key, "id__lt": last_id}), **{f"{field}__lte": key})
+
+	messages = list(qs[:PAGE_SIZE])
+	next_cursor = None
+	if len(messages) == PAGE_SIZE:
+		last = messages[-1]
+		next_cursor = encode_cursor(ordering, getattr(last, field), last.pk)
+	return serialize_messages(messages), next_cursor
+
+
+def retrieve_messages_ranked_after(geoloc, cursor):
+	try:
+		if geoloc and geoloc.is_valid():
+			block = geoloc.get_block()
+			qs = Message.objects.live().select_related('author').filter(cell=block.cell)
+			return _seek_page(qs, "ranked", "votes", cursor)
+		return None
+	except:
+		return None
+
+
+def retrieve_messages_new_after(geoloc, cursor):
+	try:
+		if geoloc and geoloc.is_valid():
+			block = geoloc.get_block()
+			qs = Message.objects.live().select_related('author').filter(cell=block.cell)
+			return _seek_page(qs, "new", "date", cursor)
+		return None
+	except:
+		return None
+
+
+def retrieve_messages_hot_after(geoloc, cursor):
+	try:
+		if geoloc and geoloc.is_valid():
+			block = geoloc.get_block()
+			qs = Message.objects.live().select_related('author').filter(cell=block.cell)
+			return _seek_page(qs, "hot", "hot", cursor)
+		return None
+	except:
+		return None
+
+
+def retrieve_user_messages_after(user_id, cursor):
+	try:
+		if user_id and isinstance(user_id, int) and user_id >= 1:
+			qs = Message.objects.live().select_related('author').filter(author_id=user_id)
+			return _seek_page(qs, "new", "date", cursor)
+		return None
+	except:
+		return None
+
+
+# totals of the cells around the geolocation at a level of the geoblock hierarchy, from the precomputed aggregates
+def retrieve_cell_summary(geoloc, level):
+	try:
+		if geoloc and geoloc.is_valid():
+			return cell_aggregates.summary(geoloc.get_cell(), level)
+		return None
 	except:
 		return None
 
 
 def upvote(id):
 	try:
-		m = Message.objects.get(pk=id)
-		m.votes += 1
-		m.save()
-		return m.votes
+		return votes.vote(int(id), 1)
 	except:
 		return None
 
 
 def downvote(id):
 	try:
-		m = Message.objects.get(pk=id)
-		m.votes -= 1
-		if m.votes <= DELETE_THRESH:
-			m.delete()
-		else:
-			m.save()
-		return m.votes
+		return votes.vote(int(id), -1)
 	except:
 		return None
 
 
-# TEST
-def update_seen(qs):
-	for m in qs:
-		model = Message.objects.get(pk=m.pk)
-		model.seen += 1
-		model.save()
+# count a view of every served message, returns the messages with views not yet written back merged in
+def update_seen(messages):
+	merged = seen_counter.merge(messages)
+	seen_counter.record([m["id"] for m in messages])
+	return merged
+
+
+# serialized messages with views not yet written back merged in
+def merge_seen(messages):
+	return seen_counter.merge(messages)
@@ -0,0 +1,193 @@
+# in process metrics of the websocket api in prometheus text format
+# frames are aggregated into fixed bucket histograms by category as they are handled (a bisect and a few
+# increments under a lock), nothing is kept per frame. /metrics renders them along with open sockets, how many
+# sockets the occupied geoblock groups have (a histogram, groups aren't labelled so no locations are exported and
+# the series don't grow with the map) and the counters of the caches, expiry sweeper and socket log
+
+import threading
+from bisect import bisect_left
+
+from . import page_cache, expiry, socket_log
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+GROUP_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+REQUEST_CODES = frozenset(list(range(18)) + [20])  # anything else a client sends is labelled "other"
+
+_lock = threading.Lock()
+_histograms = {}  # (name, category) -> _Histogram
+_groups = {}  # group -> channel names of the sockets subscribed
+_open_sockets = 0
+
+_HELP = {
+	"drop_frame_seconds": "Time spent handling a client frame",
+	"drop_frame_queries": "Database queries made handling a client frame",
+	"drop_frame_received_bytes": "Size of frames received from clients",
+	"drop_frame_sent_bytes": "Size of frames sent to clients",
+	"drop_notify_batch_size": "New message notifications per batched group event",
+	"drop_notify_delay_seconds": "Time from a post to its notification being sent to a listener",
+	"drop_group_sockets": "Websockets subscribed to each occupied geoblock group"
+}
+
+
+class _Histogram:
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)  # the last count is +Inf
+		self.sum = 0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+
+# counts the queries run on this thread's connection, use with connection.execute_wrapper
+class QueryCounter:
+	def __init__(self):
+		self.count = 0
+
+	def __call__(self, execute, sql, params, many, context):
+		self.count += 1
+		return execute(sql, params, many, context)
+
+
+def _observe(name, category, value, buckets):
+	key = (name, category)
+	with _lock:
+		histogram = _histograms.get(key)
+		if histogram is None:
+			histogram = _histograms[key] = _Histogram(buckets)
+		histogram.observe(value)
+
+
+def _request_label(code):
+	if code is None:
+		return "invalid"
+	return str(code) if isinstance(code, int) and code in REQUEST_CODES else "other"
+
+
+# a client frame was handled, code is None when it couldn't be decoded
+def frame_handled(code, seconds, queries, size):
+	category = _request_label(code)
+	_observe("drop_frame_seconds", category, seconds, LATENCY_BUCKETS)
+	_observe("drop_frame_queries", category, queries, QUERY_BUCKETS)
+	_observe("drop_frame_received_bytes", category, size, BYTES_BUCKETS)
+
+
+def frame_sent(category, size):
+	_observe("drop_frame_sent_bytes", category, size, BYTES_BUCKETS)
+
+
+def notify_batch_sent(size):
+	_observe("drop_notify_batch_size", "notify", size, BATCH_BUCKETS)
+
+
+def notification_delivered(seconds):
+	_observe("drop_notify_delay_seconds", "notify", seconds, LATENCY_BUCKETS)
+
+
+# (count, sum) of a histogram by category, e.g. for benchmarks to diff before and after a run
+def totals(name):
+	with _lock:
+		return {category: (histogram.count, histogram.sum) for (metric, category), histogram in _histograms.items() if metric == name}
+
+
+def socket_opened():
+	global _open_sockets
+	with _lock:
+		_open_sockets += 1
+
+
+def socket_closed():
+	global _open_sockets
+	with _lock:
+		_open_sockets -= 1
+
+
+# sockets are tracked by channel name so joins are idempotent like the channel layer's group_add
+def group_joined(group, channel):
+	with _lock:
+		_groups.setdefault(group, set()).add(channel)
+
+
+# groups nobody is subscribed to are dropped so the histogram only counts occupied groups
+def group_left(group, channel):
+	with _lock:
+		channels = _groups.get(group)
+		if channels is not None:
+			channels.discard(channel)
+			if not channels:
+				del _groups[group]
+
+
+def _escape(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value):
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _metric(lines, name, kind, help_text, samples):
+	lines.append(f"# HELP {name} {help_text}")
+	lines.append(f"# TYPE {name} {kind}")
+	for labels, value in samples:
+		label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+		lines.append(f"{name}{{{label_text}}} {_number(value)}" if label_text else f"{name} {_number(value)}")
+
+
+def _histogram_lines(lines, name, histograms):
+	lines.append(f"# HELP {name} {_HELP[name]}")
+	lines.append(f"# TYPE {name} histogram")
+	for category, histogram in sorted(histograms.items()):
+		# a histogram without a category (None) has no labels besides le
+		label = f'category="{_escape(category)}",' if category is not None else ""
+		cumulative = 0
+		for bound, count in zip(histogram.buckets, histogram.counts):
+			cumulative += count
+			lines.append(f'{name}_bucket{{{label}le="{bound}"}} {cumulative}')
+		lines.append(f'{name}_bucket{{{label}le="+Inf"}} {histogram.count}')
+		suffix = f"{{{label[:-1]}}}" if label else ""
+		lines.append(f"{name}_sum{suffix} {_number(histogram.sum)}")
+		lines.append(f"{name}_count{suffix} {histogram.count}")
+
+
+# every metric in prometheus text exposition format (0.0.4)
+def render():
+	with _lock:
+		histograms = {}
+		for (name, category), histogram in _histograms.items():
+			snapshot = _Histogram(histogram.buckets)
+			snapshot.counts, snapshot.sum, snapshot.count = list(histogram.counts), histogram.sum, histogram.count
+			histograms.setdefault(name, {})[category] = snapshot
+		group_sockets = _Histogram(GROUP_BUCKETS)
+		for channels in _groups.values():
+			group_sockets.observe(len(channels))
+		histograms["drop_group_sockets"] = {None: group_sockets}
+		open_sockets = _open_sockets
+
+	lines = []
+	for name in _HELP:
+		if name in histograms:
+			_histogram_lines(lines, name, histograms[name])
+
+	_metric(lines, "drop_sockets_open", "gauge", "Open websockets", [((), open_sockets)])
+
+	cache = page_cache.stats()
+	for counter in ("hits", "misses", "invalidations"):
+		_metric(lines, f"drop_page_cache_{counter}_total", "counter", f"Message page cache {counter}", [((), cache[counter])])
+
+	sweeps = expiry.stats()
+	_metric(lines, "drop_expiry_runs_total", "counter", "Expiry sweeps run", [((), sweeps["runs"])])
+	_metric(lines, "drop_expiry_swept_total", "counter", "Expired messages deleted", [((), sweeps["swept"])])
+	_metric(lines, "drop_expiry_last_swept", "gauge", "Expired messages deleted by the last sweep", [((), sweeps["last_swept"])])
+	_metric(lines, "drop_expiry_last_run_seconds", "gauge", "Duration of the last sweep", [((), sweeps["last_run_ms"] / 1000)])
+
+	log = socket_log.stats()
+	_metric(lines, "drop_socket_log_logged_total", "counter", "Socket log records written", [((), log["logged"])])
+	_metric(lines, "drop_socket_log_dropped_total", "counter", "Socket log records dropped on a full queue", [((), log["dropped"])])
+	return "\n".join(lines) + "\n"
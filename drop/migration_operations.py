@@ -0,0 +1,125 @@
+# migration operations for changing the live message table
+# on postgres indexes are built / dropped CONCURRENTLY so writes aren't blocked while they build,
+# migrations using these must set atomic = False. other databases fall back to the plain operations.
+# Backfills run in primary key batches, each in its own transaction, so they don't hold row locks on the
+# whole table until the migration ends
+
+from django.db import transaction
+from django.db.migrations.operations import AddIndex, RemoveIndex, AddConstraint
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _is_postgres(schema_editor):
+	return schema_editor.connection.vendor == "postgresql"
+
+
+def _create_concurrently(schema_editor, model, index):
+	quote = schema_editor.quote_name
+	# nothing else can own the name while the migration is unapplied, it's a leftover invalid index
+	# from an interrupted concurrent build
+	schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {quote(index.name)}")
+	sql = str(index.create_sql(model, schema_editor))
+	schema_editor.execute(sql.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1))
+
+
+def _drop_concurrently(schema_editor, index):
+	schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(index.name)}")
+
+
+class AddIndexConcurrently(AddIndex):
+
+	def database_forwards(self, app_label, schema_editor, from_state, to_state):
+		model = to_state.apps.get_model(app_label, self.model_name)
+		if not self.allow_migrate_model(schema_editor.connection.alias, model):
+			return
+		if _is_postgres(schema_editor):
+			_create_concurrently(schema_editor, model, self.index)
+		else:
+			schema_editor.add_index(model, self.index)
+
+	def database_backwards(self, app_label, schema_editor, from_state, to_state):
+		model = from_state.apps.get_model(app_label, self.model_name)
+		if not self.allow_migrate_model(schema_editor.connection.alias, model):
+			return
+		if _is_postgres(schema_editor):
+			_drop_concurrently(schema_editor, self.index)
+		else:
+			schema_editor.remove_index(model, self.index)
+
+	def describe(self):
+		return f"Concurrently create index {self.index.name} on field(s) {', '.join(self.index.fields)} of model {self.model_name}"
+
+
+class RemoveIndexConcurrently(RemoveIndex):
+
+	def database_forwards(self, app_label, schema_editor, from_state, to_state):
+		model = from_state.apps.get_model(app_label, self.model_name)
+		if not self.allow_migrate_model(schema_editor.connection.alias, model):
+			return
+		index = from_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+		if _is_postgres(schema_editor):
+			_drop_concurrently(schema_editor, index)
+		else:
+			schema_editor.remove_index(model, index)
+
+	def database_backwards(self, app_label, schema_editor, from_state, to_state):
+		model = to_state.apps.get_model(app_label, self.model_name)
+		if not self.allow_migrate_model(schema_editor.connection.alias, model):
+			return
+		index = to_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+		if _is_postgres(schema_editor):
+			_create_concurrently(schema_editor, model, index)
+		else:
+			schema_editor.add_index(model, index)
+
+	def describe(self):
+		return f"Concurrently remove index {self.name} from {self.model_name}"
+
+
+# unique constraint backed by a unique index built CONCURRENTLY, then attached with ADD CONSTRAINT ... USING INDEX,
+# which only holds the table lock for a catalog update. The constraint takes the index's name
+class AddUniqueConstraintConcurrently(AddConstraint):
+
+	def database_forwards(self, app_label, schema_editor, from_state, to_state):
+		model = to_state.apps.get_model(app_label, self.model_name)
+		if not self.allow_migrate_model(schema_editor.connection.alias, model):
+			return
+		if not _is_postgres(schema_editor):
+			schema_editor.add_constraint(model, self.constraint)
+			return
+
+		quote = schema_editor.quote_name
+		name, table = quote(self.constraint.name), quote(model._meta.db_table)
+		columns = ", ".join(quote(model._meta.get_field(field).column) for field in self.constraint.fields)
+		# a failed build (e.g. a duplicate inserted meanwhile) leaves an invalid index behind, rerunning replaces it
+		schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+		schema_editor.execute(f"CREATE UNIQUE INDEX CONCURRENTLY {name} ON {table} ({columns})")
+		schema_editor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}")
+
+	def describe(self):
+		return f"Concurrently create constraint {self.constraint.name} on model {self.model_name}"
+
+
+# calls fill(row) on every row of the queryset and saves the fields it sets, BACKFILL_BATCH_SIZE rows at a time
+# in primary key order with a transaction per batch. Use from migrations with atomic = False
+def backfill(schema_editor, queryset, fields, fill, batch_size=BACKFILL_BATCH_SIZE):
+	queryset = queryset.using(schema_editor.connection.alias).order_by("pk")
+	last = None
+	while True:
+		with transaction.atomic(using=schema_editor.connection.alias):
+			rows = list((queryset if last is None else queryset.filter(pk__gt=last))[:batch_size])
+			if not rows:
+				return
+			for row in rows:
+				fill(row)
+			queryset.bulk_update(rows, fields)
+		last = rows[-1].pk
+
+
+# deletes the rows with these primary keys, a transaction per batch
+def delete_in_batches(schema_editor, queryset, pks, batch_size=BACKFILL_BATCH_SIZE):
+	queryset = queryset.using(schema_editor.connection.alias)
+	for start in range(0, len(pks), batch_size):
+		with transaction.atomic(using=schema_editor.connection.alias):
+			queryset.filter(pk__in=pks[start:start + batch_size]).delete()
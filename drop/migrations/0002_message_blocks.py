@@ -0,0 +1,48 @@
+# Generated by Django 2.2.6 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import drop.migration_operations
+
+
+# GEOLOC_RESOLUTION at the time of this migration
+def fill_blocks(m):
+    m.lat_block, m.long_block = round(m.lat, 2), round(m.long, 2)
+
+
+def backfill_blocks(apps, schema_editor):
+    Message = apps.get_model('drop', 'Message')
+    drop.migration_operations.backfill(
+        schema_editor, Message.objects.only('id', 'lat', 'long'), ['lat_block', 'long_block'], fill_blocks
+    )
+
+
+class Migration(migrations.Migration):
+
+    # the backfill commits a batch of rows at a time
+    atomic = False
+
+    dependencies = [
+        ('drop', '0001_initial'),
+    ]
+
+    # catch up with model fields that were added without a migration
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='lat_block',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='long_block',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='message',
+            field=models.CharField(max_length=240),
+        ),
+        migrations.RunPython(backfill_blocks, migrations.RunPython.noop),
+    ]
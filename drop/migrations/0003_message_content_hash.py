@@ -0,0 +1,19 @@
+# Generated by Django 2.2.6 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drop', '0002_message_blocks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_hash',
+            field=models.CharField(default='', editable=False, max_length=40),
+            preserve_default=False,
+        ),
+    ]
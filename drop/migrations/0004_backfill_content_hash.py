@@ -0,0 +1,51 @@
+# Generated by Django 2.2.6 on 2026-10-18 09:21
+
+import hashlib
+import logging
+
+from django.db import migrations
+from django.db.models import Count, Min
+import drop.migration_operations
+
+logger = logging.getLogger(__name__)
+
+
+# drop.models.message_hash at the time of this migration
+def message_hash(message):
+    normalized = " ".join(message.split()).casefold()
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def fill_hash(m):
+    m.content_hash = message_hash(m.message)
+
+
+# hash existing messages, then keep only the oldest of any duplicates in a block so the unique constraint can be added
+def backfill_hashes(apps, schema_editor):
+    Message = apps.get_model('drop', 'Message')
+    drop.migration_operations.backfill(
+        schema_editor, Message.objects.only('id', 'message'), ['content_hash'], fill_hash
+    )
+
+    key = ('lat_block', 'long_block', 'content_hash')
+    duplicated = list(Message.objects.values(*key).annotate(first=Min('id'), copies=Count('id')).filter(copies__gt=1))
+    duplicates = []
+    for group in duplicated:
+        copies = Message.objects.filter(id__gt=group['first'], **{field: group[field] for field in key})
+        duplicates.extend(copies.values_list('id', flat=True))
+    drop.migration_operations.delete_in_batches(schema_editor, Message.objects.all(), duplicates)
+    logger.warning("deleted %d duplicate messages in %d blocks", len(duplicates), len(duplicated))
+
+
+class Migration(migrations.Migration):
+
+    # the backfill and the duplicate deletes commit a batch of rows at a time
+    atomic = False
+
+    dependencies = [
+        ('drop', '0003_message_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.6 on 2026-10-18 09:22
+
+from django.db import migrations, models
+import drop.migration_operations
+
+
+class Migration(migrations.Migration):
+
+    # CREATE UNIQUE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('drop', '0004_backfill_content_hash'),
+    ]
+
+    operations = [
+        drop.migration_operations.AddUniqueConstraintConcurrently(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('lat_block', 'long_block', 'content_hash'), name='unique_message_per_block'),
+        ),
+    ]
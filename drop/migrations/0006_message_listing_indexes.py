@@ -0,0 +1,29 @@
+# Generated by Django 2.2.6 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import drop.migration_operations
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('drop', '0005_unique_message_per_block'),
+    ]
+
+    operations = [
+        drop.migration_operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['lat_block', 'long_block', 'votes'], name='message_block_votes_idx'),
+        ),
+        drop.migration_operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['lat_block', 'long_block', 'date'], name='message_block_date_idx'),
+        ),
+        drop.migration_operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['author', 'date'], name='message_author_date_idx'),
+        ),
+    ]
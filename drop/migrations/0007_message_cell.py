@@ -0,0 +1,19 @@
+# Generated by Django 2.2.6 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drop', '0006_message_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='cell',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.6 on 2026-10-18 11:03
+
+from django.db import migrations
+import drop.migration_operations
+
+
+# drop.geo.cell_key at GEOLOC_RESOLUTION 2 at the time of this migration
+def cell_key(lat, long):
+    lat_idx = int(round(lat * 100)) + 9000
+    long_idx = int(round(long * 100)) + 18000
+    key = 0
+    for bit in range(16):
+        key |= ((lat_idx >> bit) & 1) << (2 * bit + 1)
+        key |= ((long_idx >> bit) & 1) << (2 * bit)
+    return key
+
+
+# from the stored block rather than the raw geolocation, so a half way geolocation keys the block
+# its row already sits in
+def fill_cell(m):
+    m.cell = cell_key(m.lat_block, m.long_block)
+
+
+def backfill_cells(apps, schema_editor):
+    Message = apps.get_model('drop', 'Message')
+    drop.migration_operations.backfill(
+        schema_editor, Message.objects.only('id', 'lat_block', 'long_block'), ['cell'], fill_cell
+    )
+
+
+class Migration(migrations.Migration):
+
+    # the backfill commits a batch of rows at a time
+    atomic = False
+
+    dependencies = [
+        ('drop', '0007_message_cell'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_cells, migrations.RunPython.noop),
+    ]
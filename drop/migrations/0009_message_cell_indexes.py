@@ -0,0 +1,34 @@
+# Generated by Django 2.2.6 on 2026-10-18 11:05
+
+from django.db import migrations, models
+import drop.migration_operations
+
+
+class Migration(migrations.Migration):
+
+    # CREATE / DROP INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('drop', '0008_backfill_message_cell'),
+    ]
+
+    # listings filter on the cell key now, build its indexes before dropping the float block ones
+    operations = [
+        drop.migration_operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['cell', 'votes'], name='message_cell_votes_idx'),
+        ),
+        drop.migration_operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['cell', 'date'], name='message_cell_date_idx'),
+        ),
+        drop.migration_operations.RemoveIndexConcurrently(
+            model_name='message',
+            name='message_block_votes_idx',
+        ),
+        drop.migration_operations.RemoveIndexConcurrently(
+            model_name='message',
+            name='message_block_date_idx',
+        ),
+    ]
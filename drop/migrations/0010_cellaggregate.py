@@ -0,0 +1,28 @@
+# Generated by Django 2.2.6 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drop', '0009_message_cell_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CellAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.SmallIntegerField()),
+                ('key', models.BigIntegerField()),
+                ('messages', models.IntegerField(default=0)),
+                ('votes', models.IntegerField(default=0)),
+                ('latest', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='cellaggregate',
+            constraint=models.UniqueConstraint(fields=('level', 'key'), name='unique_cell_aggregate'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.6 on 2026-10-18 12:12
+
+from django.db import migrations
+from django.db.models import Count, Max, Sum
+
+
+# GEOLOC_LEVELS at the time of this migration
+LEVELS = 6
+
+
+def backfill_aggregates(apps, schema_editor):
+    Message = apps.get_model('drop', 'Message')
+    CellAggregate = apps.get_model('drop', 'CellAggregate')
+
+    totals = {}
+    for block in Message.objects.values('cell').annotate(messages=Count('id'), votes=Sum('votes'), latest=Max('date')):
+        for level in range(LEVELS + 1):
+            key = (level, block['cell'] >> (2 * level))
+            messages, votes, latest = totals.get(key, (0, 0, None))
+            if latest is None or block['latest'] > latest:
+                latest = block['latest']
+            totals[key] = (messages + block['messages'], votes + block['votes'], latest)
+
+    rows = [
+        CellAggregate(level=level, key=key, messages=messages, votes=votes, latest=latest)
+        for (level, key), (messages, votes, latest) in totals.items()
+    ]
+    # up to 1000 rows an INSERT, fewer where the backend limits them (sqlite)
+    fields = [CellAggregate._meta.get_field(name) for name in ('level', 'key', 'messages', 'votes', 'latest')]
+    batch_size = max(1, min(1000, schema_editor.connection.ops.bulk_batch_size(fields, rows)))
+    CellAggregate.objects.bulk_create(rows, batch_size=batch_size)
+
+
+def clear_aggregates(apps, schema_editor):
+    apps.get_model('drop', 'CellAggregate').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drop', '0010_cellaggregate'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_aggregates, clear_aggregates),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.6 on 2026-10-18 14:01
+
+from django.db import migrations, models
+import drop.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drop', '0011_backfill_cell_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='expires',
+            field=models.DateTimeField(default=drop.models.message_expiry),
+        ),
+    ]
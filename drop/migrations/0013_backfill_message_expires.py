@@ -0,0 +1,34 @@
+# Generated by Django 2.2.6 on 2026-10-18 14:02
+
+from datetime import timedelta
+
+from django.db import migrations
+import drop.migration_operations
+
+
+# drop.constants.MESSAGE_TTL_HOURS at the time of this migration
+MESSAGE_TTL_HOURS = 48
+
+
+# existing messages expire 48 hours after they were posted, older ones go in the first sweep
+def fill_expires(m):
+    m.expires = m.date + timedelta(hours=MESSAGE_TTL_HOURS)
+
+
+def backfill_expires(apps, schema_editor):
+    Message = apps.get_model('drop', 'Message')
+    drop.migration_operations.backfill(schema_editor, Message.objects.only('id', 'date'), ['expires'], fill_expires)
+
+
+class Migration(migrations.Migration):
+
+    # the backfill commits a batch of rows at a time
+    atomic = False
+
+    dependencies = [
+        ('drop', '0012_message_expires'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_expires, migrations.RunPython.noop),
+    ]
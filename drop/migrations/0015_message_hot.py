@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drop', '0014_message_expires_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='hot',
+            field=models.FloatField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:11
+
+import math
+from datetime import datetime
+
+from django.db import migrations
+from django.utils.timezone import utc
+import drop.migration_operations
+
+
+# drop.models.hot_score with HOT_DECAY_SECONDS 45000 at the time of this migration
+def hot_score(votes, date):
+    magnitude = math.log10(max(abs(votes), 1))
+    if votes < 0:
+        magnitude = -magnitude
+    return magnitude + (date - datetime(2019, 1, 1, tzinfo=utc)).total_seconds() / 45000
+
+
+def fill_hot(m):
+    m.hot = hot_score(m.votes, m.date)
+
+
+def backfill_hot(apps, schema_editor):
+    Message = apps.get_model('drop', 'Message')
+    drop.migration_operations.backfill(schema_editor, Message.objects.only('id', 'votes', 'date'), ['hot'], fill_hot)
+
+
+class Migration(migrations.Migration):
+
+    # the backfill commits a batch of rows at a time
+    atomic = False
+
+    dependencies = [
+        ('drop', '0015_message_hot'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_hot, migrations.RunPython.noop),
+    ]
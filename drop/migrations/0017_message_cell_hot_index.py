@@ -0,0 +1,21 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:12
+
+from django.db import migrations, models
+import drop.migration_operations
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('drop', '0016_backfill_message_hot'),
+    ]
+
+    operations = [
+        drop.migration_operations.AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['cell', 'hot'], name='message_cell_hot_idx'),
+        ),
+    ]
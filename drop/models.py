@@ -1,10 +1,41 @@
 # Message model
 # Jeremy Vun 2726092
 
+import hashlib
+import math
+from datetime import datetime, timedelta
+
 from django.db import models
 from django.contrib.auth.models import User
-from django.utils.timezone import now
-from .constants import MAX_MESSAGE_LENGTH
+from django.utils.timezone import now, utc
+from .constants import MAX_MESSAGE_LENGTH, MESSAGE_TTL_HOURS, HOT_DECAY_SECONDS
+
+HOT_EPOCH = datetime(2019, 1, 1, tzinfo=utc)
+
+
+# hash of a message's normalized text, messages in a geoblock must differ by more than case and spacing
+def message_hash(message):
+	normalized = " ".join(message.split()).casefold()
+	return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+# hot rank of a message, the order of magnitude of its votes plus its post time in HOT_DECAY_SECONDS.
+# newer messages start higher instead of older ones decaying, so a score only changes when the votes do
+def hot_score(votes, date):
+	magnitude = math.log10(max(abs(votes), 1))
+	if votes < 0:
+		magnitude = -magnitude
+	return magnitude + (date - HOT_EPOCH).total_seconds() / HOT_DECAY_SECONDS
+
+
+def message_expiry():
+	return now() + timedelta(hours=MESSAGE_TTL_HOURS)
+
+
+class MessageQuerySet(models.QuerySet):
+	# messages that haven't expired, expired ones can sit in the table until the next sweep (drop/expiry.py)
+	def live(self):
+		return self.filter(expires__gt=now())
 
 
 class Message(models.Model):
@@ -12,11 +43,56 @@ class Message(models.Model):
 	long = models.FloatField()
 	lat_block = models.FloatField()
 	long_block = models.FloatField()
+	cell = models.BigIntegerField()  # z-order key of the geoblock, see drop/geo.py
 	message = models.CharField(max_length=MAX_MESSAGE_LENGTH)
 	date = models.DateTimeField(default=now)
 	votes = models.IntegerField(default=1)
 	seen = models.IntegerField(default=0)
 	author = models.ForeignKey(User, on_delete=models.CASCADE)
+	content_hash = models.CharField(max_length=40, editable=False)
+	expires = models.DateTimeField(default=message_expiry)
+	hot = models.FloatField(default=0, editable=False)
+
+	objects = MessageQuerySet.as_manager()
+
+	class Meta:
+		constraints = [
+			# duplicate check on post is an index probe / insert conflict instead of a case insensitive scan
+			models.UniqueConstraint(fields=['lat_block', 'long_block', 'content_hash'], name='unique_message_per_block'),
+		]
+		indexes = [
+			# every listing filters on the block and sorts by votes or date, or lists an author's messages by date.
+			# the cell prefix also serves block range scans
+			models.Index(fields=['cell', 'votes'], name='message_cell_votes_idx'),
+			models.Index(fields=['cell', 'date'], name='message_cell_date_idx'),
+			models.Index(fields=['cell', 'hot'], name='message_cell_hot_idx'),
+			models.Index(fields=['author', 'date'], name='message_author_date_idx'),
+			# the expiry sweep deletes in expires order
+			models.Index(fields=['expires'], name='message_expires_idx'),
+		]
+
+	def save(self, *args, **kwargs):
+		self.content_hash = message_hash(self.message)
+		self.hot = hot_score(self.votes, self.date)
+		super().save(*args, **kwargs)
 
 	def __str__(self):
 		return f"({self.lat},{self.long}) - {self.message} [{self.votes}]"
+
+
+# totals of the messages inside a cell at one level of the geoblock hierarchy (see drop/geo.py),
+# kept up to date incrementally so coarse requests never scan the child blocks
+class CellAggregate(models.Model):
+	level = models.SmallIntegerField()
+	key = models.BigIntegerField()
+	messages = models.IntegerField(default=0)
+	votes = models.IntegerField(default=0)
+	latest = models.DateTimeField(null=True)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['level', 'key'], name='unique_cell_aggregate'),
+		]
+
+	def __str__(self):
+		return f"L{self.level} {self.key} - {self.messages} messages [{self.votes}]"
@@ -0,0 +1,187 @@
+# distance searches around a geolocation
+# candidate messages come from the cell key index (the blocks covering a lat / long box around the search
+# circle), then one vectorized haversine pass over their coordinates filters them to the circle and sorts
+# them nearest first. Nearest messages searches grow the box ring by ring until the k nearest are known
+
+import math
+
+import numpy as np
+from django.db.models import Q
+
+from drop.models import Message
+from .constants import EARTH_RADIUS_KM, PAGE_SIZE, NEAREST_MAX_BLOCKS
+from .geo import cell_ranges, lat_index, long_index, LAT_INDEX_MAX, LONG_INDEX_MAX, SCALE
+
+KM_PER_DEGREE = math.radians(1) * EARTH_RADIUS_KM  # km per degree of latitude
+
+
+# great circle km from (lat, long) to every point of the lat / long degree arrays
+def haversine_km(lat, long, lats, longs):
+	lat, long = math.radians(lat), math.radians(long)
+	lats, longs = np.radians(lats), np.radians(longs)
+	a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((longs - long) / 2) ** 2
+	return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# an inclusive block index box clamped to the map, long indexes taken around the globe (the box is split in
+# two when it crosses the antimeridian). Indexes 0 and LONG_INDEX_MAX are the same +-180 degree block,
+# messages there are stored under either, so a box touching one also covers the other
+def wrap_box(lat_lo, lat_hi, long_lo, long_hi):
+	lat_lo, lat_hi = max(0, lat_lo), min(LAT_INDEX_MAX, lat_hi)
+	if lat_lo > lat_hi or long_lo > long_hi:
+		return []
+	if long_hi - long_lo + 1 >= LONG_INDEX_MAX:
+		return [(lat_lo, lat_hi, 0, LONG_INDEX_MAX)]
+
+	long_lo, long_hi = long_lo % LONG_INDEX_MAX, long_hi % LONG_INDEX_MAX
+	if long_lo > long_hi:
+		return [(lat_lo, lat_hi, long_lo, LONG_INDEX_MAX), (lat_lo, lat_hi, 0, long_hi)]
+	if long_lo == 0:
+		return [(lat_lo, lat_hi, 0, long_hi), (lat_lo, lat_hi, LONG_INDEX_MAX, LONG_INDEX_MAX)]
+	return [(lat_lo, lat_hi, long_lo, long_hi)]
+
+
+# inclusive block index boxes covering the circle
+def index_boxes(lat, long, radius_km):
+	d_lat = radius_km / KM_PER_DEGREE
+	lat_lo, lat_hi = lat_index(lat - d_lat), lat_index(lat + d_lat)
+
+	# a degree of longitude narrows towards the poles, size the box at the circle's most polar latitude
+	polar = min(90.0, abs(lat) + d_lat)
+	cos_polar = math.cos(math.radians(polar))
+	if cos_polar <= 1e-9 or d_lat / cos_polar >= 180:
+		return wrap_box(lat_lo, lat_hi, 0, LONG_INDEX_MAX)
+
+	d_long = d_lat / cos_polar
+	return wrap_box(lat_lo, lat_hi, long_index(long - d_long), long_index(long + d_long))
+
+
+# Q matching messages in any of the index boxes. Inexact covers take in extra blocks, the distance
+# pass drops them so there is no need for a residual filter
+def in_boxes(boxes):
+	q = Q()
+	for box in boxes:
+		ranges, exact = cell_ranges(*box)
+		for lo, hi in ranges:
+			q |= Q(cell__range=(lo, hi))
+	return q
+
+
+# (ids, lats, longs) arrays of the messages matching q
+def candidates(q):
+	rows = np.array(list(Message.objects.live().filter(q).values_list('id', 'lat', 'long')), dtype=np.float64).reshape(-1, 3)
+	return rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2]
+
+
+# (ids, distances) of the messages within radius_km of the geolocation, nearest first
+def within(lat, long, radius_km):
+	return within_candidates(lat, long, radius_km, *candidates(in_boxes(index_boxes(lat, long, radius_km))))
+
+
+def within_candidates(lat, long, radius_km, ids, lats, longs):
+	distances = haversine_km(lat, long, lats, longs)
+
+	inside = distances <= radius_km
+	ids, distances = ids[inside], distances[inside]
+	order = np.lexsort((ids, distances))
+	return ids[order], distances[order]
+
+
+# boxes of the blocks between the inner and outer (lat reach, long reach) rectangles of blocks around the
+# centre block, an inner of None takes in the whole outer rectangle
+def ring_boxes(lat_c, long_c, inner, outer):
+	lat_out, long_out = outer
+	if inner is None:
+		return wrap_box(lat_c - lat_out, lat_c + lat_out, long_c - long_out, long_c + long_out)
+
+	lat_in, long_in = inner
+	return (
+		wrap_box(lat_c - lat_out, lat_c - lat_in - 1, long_c - long_out, long_c + long_out) +
+		wrap_box(lat_c + lat_in + 1, lat_c + lat_out, long_c - long_out, long_c + long_out) +
+		wrap_box(lat_c - lat_in, lat_c + lat_in, long_c - long_out, long_c - long_in - 1) +
+		wrap_box(lat_c - lat_in, lat_c + lat_in, long_c + long_in + 1, long_c + long_out)
+	)
+
+
+# (lat reach, long reach) in blocks of a ring radius blocks out. Blocks narrow towards the poles, so the
+# long reach is widened to keep the rectangle roughly square on the ground, up to the whole map around
+def ring_reach(lat, radius):
+	polar = min(90.0, abs(lat) + radius / SCALE)
+	cos_polar = math.cos(math.radians(polar))
+	if cos_polar * LONG_INDEX_MAX / 2 <= radius:
+		return radius, LONG_INDEX_MAX // 2
+	return radius, int(math.ceil(radius / cos_polar))
+
+
+# km from the geolocation to the closest point outside the rectangle of blocks reaching (lat, long) blocks out
+# from its block, every message nearer than this has been seen once the rectangle is searched
+def covered_km(lat, long, reach):
+	lat_gap = (reach[0] + 0.5 - abs(lat * SCALE - round(lat * SCALE))) / SCALE
+	long_gap = (reach[1] + 0.5 - abs(long * SCALE - round(long * SCALE))) / SCALE
+
+	# north / south edges are parallels, east / west edges lie on meridians (none once it wraps the map)
+	covered = lat_gap * KM_PER_DEGREE
+	if long_gap < 90:
+		covered = min(covered, EARTH_RADIUS_KM * math.asin(math.cos(math.radians(lat)) * math.sin(math.radians(long_gap))))
+	elif long_gap < 180:
+		covered = min(covered, (90 - abs(lat)) * KM_PER_DEGREE)
+	return covered
+
+
+# (ids, distances) of the k messages nearest the geolocation, nearest first. The searched rectangle doubles
+# ring by ring and stops once the k nearest found are closer than anything outside it could be,
+# or at NEAREST_MAX_BLOCKS out
+def nearest(lat, long, k):
+	lat_c, long_c = lat_index(lat), long_index(long)
+	ids, distances = np.array([], dtype=np.int64), np.array([])
+	inner, radius = None, 0
+	while True:
+		outer = ring_reach(lat, radius)
+		boxes = ring_boxes(lat_c, long_c, inner, outer)
+		if boxes:
+			ring_ids, lats, longs = candidates(in_boxes(boxes))
+
+			# inexact cell range covers and wrapped rectangles can return a message in more than one ring
+			ids, first = np.unique(np.concatenate((ids, ring_ids)), return_index=True)
+			distances = np.concatenate((distances, haversine_km(lat, long, lats, longs)))[first]
+
+		if radius >= NEAREST_MAX_BLOCKS:
+			break
+		if len(ids) >= k and np.partition(distances, k - 1)[k - 1] <= covered_km(lat, long, outer):
+			break
+		inner, radius = outer, min(NEAREST_MAX_BLOCKS, radius * 2 + 1)
+
+	order = np.lexsort((ids, distances))[:k]
+	return ids[order], distances[order]
+
+
+# pages of a distance search's results, nearest first. Pages like a Paginator (num_pages, page) so the
+# protocol can hold on to it between requests, messages deleted since the search are skipped
+class DistanceFeed:
+	def __init__(self, ids, distances):
+		self.ids = ids
+		self.distances = distances
+		self.num_pages = max(1, math.ceil(len(ids) / PAGE_SIZE))
+
+	def page(self, page_num):
+		start = (page_num - 1) * PAGE_SIZE
+		page_ids = self.ids[start:start + PAGE_SIZE].tolist()
+		if not page_ids:
+			return []
+
+		messages = Message.objects.live().select_related('author').in_bulk(page_ids)
+		result = []
+		for msg_id, distance in zip(page_ids, self.distances[start:start + PAGE_SIZE].tolist()):
+			if msg_id in messages:
+				m = messages[msg_id]
+				m.distance = distance
+				result.append(m)
+		return result
+
+
+def new_feed(lat, long, radius_km):
+	return DistanceFeed(*within(lat, long, radius_km))
+
+
+def nearest_feed(lat, long, k):
+	return DistanceFeed(*nearest(lat, long, k))
@@ -0,0 +1,62 @@
+# coalesces new message notifications per channel layer group
+# instead of a group_send per post, posts to a group are collected for NOTIFY_BATCH_WINDOW seconds (or until
+# NOTIFY_BATCH_MAX of them) and sent as one receive_notification_batch event, so a busy block costs one channel
+# layer publish and one frame per listener per window. Batches live on the event loop the channel layer runs on,
+# the sync consumer reaches it through async_to_sync like its other channel layer calls
+
+import asyncio
+import time
+import weakref
+
+from .constants import NOTIFY_BATCH_WINDOW, NOTIFY_BATCH_MAX
+from . import metrics
+
+_batches = weakref.WeakKeyDictionary()  # event loop -> {group: _Batch}
+
+
+class _Batch:
+	def __init__(self):
+		self.notifications = []
+		self.timer = None
+
+
+# a notification entry {id, payload and packed (optional), sender, queued}, queued being the time.time() it was
+# posted and packed the payload as tagged MessagePack for binary sockets
+def notification(message_id, payload, packed, sender):
+	entry = {'id': message_id, 'sender': sender, 'queued': time.time()}
+	if payload is not None:
+		entry['payload'] = payload
+		entry['packed'] = packed
+	return entry
+
+
+async def _flush(channel_layer, groups, group):
+	batch = groups.pop(group, None)
+	if batch is None:
+		return
+	if batch.timer is not None:
+		batch.timer.cancel()
+
+	metrics.notify_batch_sent(len(batch.notifications))
+	await channel_layer.group_send(group, {
+		# type specifies the function to be called when received
+		'type': 'receive_notification_batch',
+		'messages': batch.notifications
+	})
+
+
+# add a notification to the group's batch, the first one starts the window
+async def add(channel_layer, group, entry):
+	loop = asyncio.get_event_loop()
+	groups = _batches.get(loop)
+	if groups is None:
+		groups = _batches[loop] = {}
+
+	batch = groups.get(group)
+	if batch is None:
+		batch = groups[group] = _Batch()
+		batch.timer = loop.call_later(NOTIFY_BATCH_WINDOW, lambda: loop.create_task(_flush(channel_layer, groups, group)))
+	batch.notifications.append(entry)
+
+	if len(batch.notifications) >= NOTIFY_BATCH_MAX:
+		await _flush(channel_layer, groups, group)
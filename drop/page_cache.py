@@ -0,0 +1,93 @@
+# shared cache of serialized message pages keyed by (scope, ordering, page)
+# a scope is a geoblock or a user's own messages. Every scope has a generation number that is part of
+# its page keys, bumping it invalidates all of the scope's cached pages with a single write
+
+import threading
+import time
+
+from django.core.cache import caches
+from django.utils.timezone import now
+from .constants import PAGE_CACHE_ALIAS, PAGE_CACHE_TTL, PAGE_SIZE
+from .util import serialize_message, block_name
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _count(name):
+	with _lock:
+		_counters[name] += 1
+
+
+# hit/miss counters for this process
+def stats():
+	with _lock:
+		return dict(_counters)
+
+
+def _generation_key(scope):
+	return f"pagegen:{scope}"
+
+
+# generations start from the clock so a scope whose generation was evicted can't resurrect stale pages
+def _new_generation():
+	return int(time.time() * 1000)
+
+
+def _generation(cache, scope):
+	gen = cache.get(_generation_key(scope))
+	if gen is None:
+		cache.add(_generation_key(scope), _new_generation(), None)
+		gen = cache.get(_generation_key(scope))
+	return gen
+
+
+# get a value cached for the scope, calling build only on a miss. build returns (value, seconds to cache it),
+# invalidating the scope drops it
+def get_scoped(scope, name, build):
+	cache = caches[PAGE_CACHE_ALIAS]
+	key = f"page:{scope}:{_generation(cache, scope)}:{name}"
+
+	value = cache.get(key)
+	if value is not None:
+		_count("hits")
+		return value
+
+	_count("misses")
+	value, ttl = build()
+	if ttl > 0:
+		cache.set(key, value, ttl)
+	return value
+
+
+# get a page of serialized messages for the scope, running the ordered queryset only on a miss.
+# a page is never cached past the expiry of its first message to expire
+def get_page(scope, ordering, page_num, qs):
+	def build():
+		start = (page_num - 1) * PAGE_SIZE
+		messages = list(qs[start:start + PAGE_SIZE])
+		ttl = PAGE_CACHE_TTL
+		if messages:
+			ttl = min(ttl, int((min(m.expires for m in messages) - now()).total_seconds()))
+		return [serialize_message(m) for m in messages], ttl
+
+	return get_scoped(scope, f"{ordering}:{page_num}", build)
+
+
+# drop every cached page of the scopes
+def invalidate(*scopes):
+	cache = caches[PAGE_CACHE_ALIAS]
+	for scope in scopes:
+		_count("invalidations")
+		try:
+			cache.incr(_generation_key(scope))
+		except ValueError:
+			cache.set(_generation_key(scope), _new_generation(), None)
+
+
+def block_scope(cell):
+	return block_name(cell)
+
+
+def user_scope(user_id):
+	return f"user-{user_id}"
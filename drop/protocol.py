@@ -0,0 +1,476 @@
+# websocket category protocol shared by the sync and async message consumers
+
+import json
+import time
+
+from drop.custom_exceptions import TokenError
+from django.db import close_old_connections, connection
+
+# business imports
+from .util import *
+from .constants import NOTIFY_PAYLOAD_MAX_BYTES, BATCH_MAX_REQUESTS, NOTIFY_BATCH_WINDOW
+from .geo import parse_level
+from .encoding import Encoded, encoded_array, pack_data, encode_frame, encode_msgpack_frame, decode_msgpack_request, parse_version
+from .encoding import batch_data, encode_msgpack_batch
+from drop import message_facade as mf
+from drop import token_cache
+from drop import socket_log
+from drop import metrics
+from drop import notify_batcher
+from drop import subscriptions
+
+# categories that page through a listing of messages
+LISTING_CATEGORIES = (2, 3, 4, 5, 6, 15, 16, 17)
+
+
+# Category routing for a messages socket. Handlers are plain blocking code (they hit the db),
+# socket side effects go through the hooks below so each consumer can perform them its own way
+class MessagesProtocol:
+    notified_id = 0
+    last_code = None
+    qs_cache = None
+    geoloc = None
+    level = 0  # level of the geoblock hierarchy the socket is subscribed at
+    protocol_version = 1  # frame encoding negotiated at authentication, see drop/encoding.py
+    binary = False  # socket opened with the msgpack subprotocol
+    notify_batch = False  # client opted in to "notify_batch" frames at authentication
+    subscribed = None  # (group, level) the socket receives new message notifications from
+    batch_results = None  # replies of the batched request being handled, collected instead of sent
+
+    # send a frame down the socket, text for a str and binary for bytes
+    def send_frame(self, frame):
+        raise NotImplementedError
+
+    # close the socket from the server end
+    def close_socket(self):
+        raise NotImplementedError
+
+    # subscribe this socket to a channel layer group
+    def join_group(self, group):
+        raise NotImplementedError
+
+    # unsubscribe this socket from a channel layer group
+    def leave_group(self, group):
+        raise NotImplementedError
+
+    # send an event to every socket in a channel layer group
+    def send_group(self, group, event):
+        raise NotImplementedError
+
+    # add a new message notification to a channel layer group's next batched event, see drop/notify_batcher.py
+    def notify_group(self, group, notification):
+        raise NotImplementedError
+
+    # channel layer group of the cell the socket is subscribed to
+    def group_name(self):
+        return self.geoloc.get_block_name(self.level)
+
+    # subscribe to the group of our cell at our level, leaving the one we were in
+    def subscribe(self):
+        self.unsubscribe()
+        self.subscribed = (self.group_name(), self.level)
+        subscriptions.joined(self.level)
+        self.join_group(self.subscribed[0])
+
+    def unsubscribe(self):
+        if self.subscribed is not None:
+            group, level = self.subscribed
+            self.subscribed = None
+            subscriptions.left(level)
+            self.leave_group(group)
+
+    # handle a client frame, timing it and counting its db queries for the metrics endpoint
+    def handle_frame(self, text_data=None, bytes_data=None):
+        start = time.perf_counter()
+        size = len(bytes_data) if bytes_data is not None else len(text_data or "")
+        queries = metrics.QueryCounter()
+        with connection.execute_wrapper(queries):
+            code = self.route_frame(text_data, bytes_data, size)
+        metrics.frame_handled(code, time.perf_counter() - start, queries.count, size)
+
+    # Route client request according to category code, returns the code (None if the frame couldn't be decoded)
+    # 0. post message
+    # 1. retrieve ranked messages
+    # 2. retrieve new messages
+    # 3. retrieve random messages
+    # 4. retrieve messages in range
+    def route_frame(self, text_data, bytes_data, size):
+        code = None
+        try:
+            close_old_connections()
+            if bytes_data is not None:
+                json_data = decode_msgpack_request(bytes_data)
+            else:
+                json_data = json.loads(text_data)
+            code = json_data['category']
+
+            # user authentication
+            if code == 11 or self.geoloc is None or self.scope["user"].id is None:
+                try:
+                    socket_log.received(None, code, json_data, size)
+
+                    # parse the geolocation
+                    self.geoloc = parse_geoloc(json_data["lat"], json_data["long"])
+                    if self.geoloc is not None:
+                        # authenticate the user
+                        user = authenticate_token(json_data["token"])
+                        self.scope["user"] = user
+
+                        # user is authenticated with a valid geolocation, old clients don't send a version
+                        self.protocol_version = parse_version(json_data.get("version", 1))
+                        self.notify_batch = json_data.get("notify_batch") is True
+                        socket_log.event(user.username, "authenticated", block=self.geoloc.get_block_string())
+
+                        # add user to a geoblock layer group, or to a coarser cell's group
+                        if self.geoloc and self.geoloc.is_valid():
+                            self.level = parse_level(json_data.get("level", 0))
+                            self.subscribe()
+                            self.send_message_to_client("socket", "open")
+                    else:
+                        raise ValueError("Invalid Geolocation")
+                except:
+                    raise TokenError("Invalid Access Token")
+
+            # user is authenticated, receive the client message and route based on category code
+            else:
+                socket_log.received(self.scope['user'].username, code, json_data, size)
+                if code == 20:
+                    self.handle_batch(json_data.get('data'))
+                else:
+                    self.handle_request(code, json_data)
+
+        # handle exceptions
+        except Exception as e:
+            if e is TokenError:
+                self.send_message_to_client("token", f"{e}")
+            else:
+                self.send_message_to_client("error", f"{e}")
+
+            self.close_socket()
+
+        return code
+
+    # handle a request from an authenticated client
+    def handle_request(self, code, json_data):
+        # a listing of another category ends the socket's held search, its next page starts a new one
+        if code in LISTING_CATEGORIES and code != self.last_code:
+            self.last_code = None
+
+        # client wishes to close the socket
+        if code == 9:
+            self.send_message_to_client("socket", "closed")
+            self.close_socket()
+
+        # create message
+        elif code == 0:
+            m = mf.create_message(geoloc=self.geoloc, message=parse_message(json_data['data']), author=self.scope["user"])
+            if m:
+                m_json = serialize_message(m)
+                json_response = {
+                    "echo": m_json,
+                    "result": True,
+                    "meta": ""
+                }
+                self.send_message_to_client("post", json_response)
+                self.notify_geoloc_group(m, m_json)
+            else:
+                json_response = {
+                    "echo": serialize_message(m),
+                    "result": False,
+                    "meta": "duplicate"
+                }
+                self.send_message_to_client("post", json_response)
+
+        elif code == 10:
+            mf.delete_message(json_data['data'], self.scope['user'].id)
+
+        # change geolocation
+        elif code == 1:
+            new_geoloc = Geoloc(json_data['lat'], json_data['long'])
+            if new_geoloc.is_valid():
+                # move to the new cell's group, a held search was around the old geolocation
+                self.geoloc = new_geoloc
+                self.last_code = None
+                self.level = parse_level(json_data.get("level", self.level))
+                self.subscribe()
+
+                self.send_message_to_client("geoloc", {
+                    "result": True,
+                    "lat": self.geoloc.lat,
+                    "long": self.geoloc.long
+                })
+            else:
+                self.send_message_to_client("geoloc", {
+                    "result": False,
+                    "lat": self.geoloc.lat,
+                    "long": self.geoloc.long
+                })
+
+        # retrieve a single message
+        elif code == 12:
+            msg_id = int(json_data["data"])
+            m = serialize_message(mf.retrieve_single_message(msg_id))
+            if m:
+                m = mf.merge_seen([m])[0]
+            self.send_message_to_client("single", m)
+
+        # message totals of the cells around us at a level of the geoblock hierarchy
+        elif code == 14:
+            level = parse_level(json_data.get("data", self.level))
+            self.send_message_to_client("cells", mf.retrieve_cell_summary(geoloc=self.geoloc, level=level))
+
+        # retrieve all messages in geolocation but return only stubs
+        elif code == 13:
+            response = mf.retrieve_message_stubs(geoloc=self.geoloc)
+            self.send_message_to_client("stubs", response)
+
+        # Upvote
+        elif code == 7:
+            msg_id = int(json_data["data"])
+            votes = mf.upvote(msg_id)
+            if votes is None:
+                json_response = {
+                    "id": msg_id,
+                    "success": False,
+                    "meta": "Not found"
+                }
+                self.send_message_to_client("vote", json_response)
+            else:
+                json_response = {
+                    "id": msg_id,
+                    "success": True,
+                    "meta": str(votes)
+                }
+                self.send_message_to_client("vote", json_response)
+
+        # Downvote
+        elif code == 8:
+            msg_id = int(json_data["data"])
+            votes = mf.downvote(msg_id)
+            if votes is None:
+                json_response = {
+                    "id": msg_id,
+                    "success": False,
+                    "meta": "Not found"
+                }
+                self.send_message_to_client("vote", json_response)
+            else:
+                json_response = {
+                    "id": msg_id,
+                    "success": True,
+                    "meta": str(votes)
+                }
+                self.send_message_to_client("vote", json_response)
+
+        # cursor paginated listings, the client sends back the cursor of the previous page ("" for the first)
+        elif code in (2, 3, 6, 17) and "cursor" in json_data:
+            cursor = json_data["cursor"]
+            if code == 2:
+                self.send_cursor_page(mf.retrieve_messages_ranked_after(geoloc=self.geoloc, cursor=cursor))
+            elif code == 3:
+                self.send_cursor_page(mf.retrieve_messages_new_after(geoloc=self.geoloc, cursor=cursor))
+            elif code == 17:
+                self.send_cursor_page(mf.retrieve_messages_hot_after(geoloc=self.geoloc, cursor=cursor))
+            else:
+                self.send_cursor_page(mf.retrieve_user_messages_after(self.scope["user"].id, cursor))
+
+        else:
+            page_num = max(1, parse_int(json_data['page']))
+
+            # Messages by vote ranking
+            if code == 2:
+                self.send_retrieved_messages(mf.retrieve_messages_ranked(geoloc=self.geoloc, page_num=page_num))
+
+            # Newest Messages
+            elif code == 3:
+                self.send_retrieved_messages(mf.retrieve_messages_new(geoloc=self.geoloc, page_num=page_num))
+
+            # Messages by hot rank, votes weighed against age
+            elif code == 17:
+                self.send_retrieved_messages(mf.retrieve_messages_hot(geoloc=self.geoloc, page_num=page_num))
+
+            # Messages posted by the user
+            elif code == 6:
+                self.send_retrieved_messages(mf.retrieve_user_messages(self.scope["user"].id, page_num))
+
+            # random, range, radius and nearest results are particular to this socket, we already have a query set
+            # paginated, return the requested page instead of hitting DB. Page 1 starts a new search
+            elif code == self.last_code and self.qs_cache and page_num > 1:
+                if page_num > self.qs_cache.num_pages:
+                    self.send_retrieved_messages([]) # send empty is emmpty
+                else:
+                    self.send_retrieved_messages(serialize_messages(self.qs_cache.page(page_num)))
+
+            # Messages sorted randomly
+            elif code == 4:
+                self.qs_cache = mf.retrieve_messages_random(geoloc=self.geoloc)
+                self.last_code = 4
+                page_num = min(page_num, self.qs_cache.num_pages)
+                self.send_retrieved_messages(serialize_messages(self.qs_cache.page(page_num)))
+
+            # Messages within a lat/long area
+            elif code == 5:
+                self.qs_cache = mf.retrieve_messages_range(geoloc=self.geoloc, geoloc_range=parse_coord_range(json_data['data']))
+                self.last_code = 5
+                page_num = min(page_num, self.qs_cache.num_pages)
+                self.send_retrieved_messages(serialize_messages(self.qs_cache.page(page_num)))
+
+            # Messages within a radius in km, nearest first
+            elif code == 15:
+                self.qs_cache = mf.retrieve_messages_radius(geoloc=self.geoloc, radius_km=parse_radius(json_data['data']))
+                self.last_code = 15
+                page_num = min(page_num, self.qs_cache.num_pages)
+                self.send_retrieved_messages(serialize_messages(self.qs_cache.page(page_num)))
+
+            # The k messages nearest us however far away they are, nearest first
+            elif code == 16:
+                self.qs_cache = mf.retrieve_messages_nearest(geoloc=self.geoloc, k=parse_nearest(json_data.get('data')))
+                self.last_code = 16
+                page_num = min(page_num, self.qs_cache.num_pages)
+                self.send_retrieved_messages(serialize_messages(self.qs_cache.page(page_num)))
+
+    # run a batch of requests in order, replying with one "batch" frame holding each request's result
+    def handle_batch(self, requests):
+        if not isinstance(requests, list) or not 0 < len(requests) <= BATCH_MAX_REQUESTS:
+            raise ValueError(f"A batch carries 1 to {BATCH_MAX_REQUESTS} requests")
+
+        results = []
+        for json_data in requests:
+            self.batch_results = []
+            try:
+                code = json_data['category']
+                if code in (9, 11, 20):
+                    raise ValueError(f"Category {code} can't be batched")
+                self.handle_request(code, json_data)
+            except Exception as e:
+                self.batch_results = [("error", f"{e}")]
+            finally:
+                replies, self.batch_results = self.batch_results, None
+
+            # requests without a reply (delete) get an empty result so results line up with requests
+            results.append(replies[0] if replies else (None, None))
+        self.send_batch(results)
+
+    # notify whole group of a new message
+    def notify_geoloc_group(self, message, m_json=None):
+        if message:
+            # encode the message once here (as JSON and as MessagePack for binary sockets) so receivers forward it
+            # without touching the db, oversized payloads fall back to id only events (json.dumps output is ascii,
+            # chars == bytes)
+            m_json = m_json if m_json is not None else serialize_message(message)
+            payload = json.dumps(m_json)
+            packed = pack_data(m_json)
+            if len(payload) > NOTIFY_PAYLOAD_MAX_BYTES:
+                payload = packed = None
+
+            # sockets subscribe at different levels of the hierarchy, notify the cell at every level somebody listens at
+            levels = subscriptions.active_levels()
+            if NOTIFY_BATCH_WINDOW > 0:
+                entry = notify_batcher.notification(message.pk, payload, packed, self.channel_name)
+                for level in levels:
+                    self.notify_group(self.geoloc.get_block_name(level), entry)
+                return
+
+            self.notified_id = message.pk
+            event = {
+                # type specifies the function to be called when received
+                'type': 'receive_notification',
+                'id': message.pk
+            }
+            if payload is not None:
+                event['payload'] = payload
+                event['packed'] = packed
+            for level in levels:
+                self.send_group(self.geoloc.get_block_name(level), event)
+
+    # handle receiving a new message
+    def handle_notification(self, event):
+        id = event['id']
+        if self.notified_id == id:
+            self.notified_id = 0
+            return
+
+        payload = event.get('payload')
+        if payload is not None:
+            payload = Encoded(payload, event.get('packed'))
+        else:
+            payload = serialize_message(mf.retrieve_single_message(id))
+            if payload is None:
+                return
+        self.send_message_to_client("notify", payload)
+
+    # handle a batch of new messages, skipping our own posts. Sockets that opted in with "notify_batch" get them
+    # in one "notify_batch" frame, everybody else a "notify" frame per message like before batching
+    def handle_notification_batch(self, event):
+        messages = []
+        timestamp = time.time()
+        for entry in event['messages']:
+            if entry['sender'] == self.channel_name:
+                continue
+
+            payload = entry.get('payload')
+            if payload is not None:
+                payload = Encoded(payload, entry.get('packed'))
+            else:
+                payload = serialize_message(mf.retrieve_single_message(entry['id']))
+                if payload is None:
+                    continue
+            messages.append(payload)
+            metrics.notification_delivered(timestamp - entry['queued'])
+
+        if self.notify_batch:
+            if messages:
+                self.send_message_to_client("notify_batch", encoded_array(messages))
+        else:
+            for m in messages:
+                self.send_message_to_client("notify", m)
+
+    # send a page of serialized messages back to the client
+    def send_retrieved_messages(self, messages):
+        if messages is not None:
+            self.send_message_to_client("retrieve", mf.update_seen(messages))
+        else:
+            self.send_message_to_client("retrieve", "")
+
+    # send a cursor page of serialized messages and the cursor to fetch the next one with
+    def send_cursor_page(self, page):
+        if page is not None:
+            messages, cursor = page
+            self.send_message_to_client("page", {
+                "messages": mf.update_seen(messages),
+                "cursor": cursor
+            })
+        else:
+            self.send_message_to_client("page", "")
+
+    # send a data frame to the client, encoded for the socket's subprotocol and protocol version
+    def send_message_to_client(self, category, data):
+        if self.batch_results is not None:
+            self.batch_results.append((category, data))
+            return
+
+        if self.binary:
+            frame = encode_msgpack_frame(category, data)
+        else:
+            frame = encode_frame(category, data, self.protocol_version)
+        self.send_encoded(category, frame)
+
+    # send the results of a batch as one frame
+    def send_batch(self, results):
+        if self.binary:
+            frame = encode_msgpack_batch(results)
+        else:
+            frame = encode_frame("batch", batch_data(results), self.protocol_version)
+        self.send_encoded("batch", frame)
+
+    def send_encoded(self, category, frame):
+        socket_log.sent(self.scope['user'].username, category, frame)
+        metrics.frame_sent(category, len(frame))
+        self.send_frame(frame)
+
+
+def authenticate_token(token):
+    try:
+        return token_cache.authenticate(token)
+    except:
+        raise TokenError("Invalid access token")
@@ -0,0 +1,44 @@
+# random order message feed without ORDER BY RANDOM()
+# the ids of a block's messages are cached as a packed int64 array under the block's page cache scope,
+# every feed session shuffles its own copy once and each page is a single primary key lookup batch
+
+import math
+import random
+from array import array
+
+from drop.models import Message
+from .constants import PAGE_SIZE, PAGE_CACHE_TTL
+from . import page_cache
+
+
+# packed ids of every message in the block, shared by all sockets until the block's pages are invalidated
+def block_ids(cell):
+	def build():
+		return array('q', Message.objects.live().filter(cell=cell).values_list('id', flat=True)).tobytes(), PAGE_CACHE_TTL
+
+	ids = array('q')
+	ids.frombytes(page_cache.get_scoped(page_cache.block_scope(cell), "ids", build))
+	return ids
+
+
+# one session's walk through a block in random order. Pages are slices of a fixed permutation so a session
+# never sees a message twice, messages expired or deleted since the session started are skipped.
+# Pages like a Paginator (num_pages, page) so the protocol can hold on to it between requests
+class RandomFeed:
+	def __init__(self, ids, seed=None):
+		random.Random(seed).shuffle(ids)
+		self.ids = ids
+		self.num_pages = max(1, math.ceil(len(ids) / PAGE_SIZE))
+
+	def page(self, page_num):
+		start = (page_num - 1) * PAGE_SIZE
+		page_ids = self.ids[start:start + PAGE_SIZE].tolist()
+		if not page_ids:
+			return []
+
+		messages = Message.objects.live().select_related('author').in_bulk(page_ids)
+		return [messages[msg_id] for msg_id in page_ids if msg_id in messages]
+
+
+def new_feed(cell, seed=None):
+	return RandomFeed(block_ids(cell), seed)
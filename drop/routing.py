@@ -1,6 +1,11 @@
 from django.urls import path
-from .consumers import MessagesConsumer
+from .constants import ASYNC_CONSUMER
+from .consumers import MessagesConsumer, AsyncMessagesConsumer
 
 websocket_urlpatterns = [
-    path('ws/', MessagesConsumer),
-]
\ No newline at end of file
+    path('ws/', AsyncMessagesConsumer if ASYNC_CONSUMER else MessagesConsumer),
+
+    # both consumers speak the same protocol, explicit endpoints to run them side by side
+    path('ws/sync/', MessagesConsumer),
+    path('ws/async/', AsyncMessagesConsumer),
+]
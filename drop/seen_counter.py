@@ -0,0 +1,106 @@
+# write-behind accumulator for message seen counts
+# served pages only record their ids here, a flusher thread writes the counts back periodically with one
+# UPDATE ... SET seen = seen + n per distinct increment, so concurrent readers never overwrite each other
+
+import atexit
+import threading
+import time
+from collections import defaultdict
+
+from django.db import close_old_connections
+from django.db.models import F
+from drop.models import Message
+from .constants import SEEN_FLUSH_INTERVAL, SEEN_MAX_BUFFERED, SEEN_FLUSH_BATCH
+from . import page_cache, message_cache, socket_log
+
+_lock = threading.Lock()
+_pending = {}  # msg id -> views not yet written
+_flushing = {}  # batch being written, still counted as pending until it commits
+_flusher = None
+
+
+# count one view of every message id
+def record(msg_ids):
+	with _lock:
+		for msg_id in msg_ids:
+			_pending[msg_id] = _pending.get(msg_id, 0) + 1
+		full = len(_pending) >= SEEN_MAX_BUFFERED
+
+	_start_flusher()
+	if full:
+		flush()
+
+
+# views of the message not yet written to the db
+def pending(msg_id):
+	return _pending.get(msg_id, 0) + _flushing.get(msg_id, 0)
+
+
+# copies of serialized messages with their unwritten views added to seen
+def merge(messages):
+	result = []
+	for m in messages:
+		n = pending(m["id"])
+		result.append(dict(m, seen=m["seen"] + n) if n else m)
+	return result
+
+
+# write buffered counts back to the db
+def flush():
+	global _pending, _flushing
+	with _lock:
+		if not _pending or _flushing:
+			return
+		_flushing, _pending = _pending, {}
+
+	try:
+		# group ids by increment so each statement is a plain seen = seen + n over an id list
+		by_increment = defaultdict(list)
+		for msg_id, n in _flushing.items():
+			by_increment[n].append(msg_id)
+
+		for n, msg_ids in by_increment.items():
+			for i in range(0, len(msg_ids), SEEN_FLUSH_BATCH):
+				Message.objects.filter(pk__in=msg_ids[i:i + SEEN_FLUSH_BATCH]).update(seen=F('seen') + n)
+
+		# cached pages of the touched blocks/authors now hold stale counts
+		flushed = list(_flushing)
+		scopes = set()
+		for i in range(0, len(flushed), SEEN_FLUSH_BATCH):
+			rows = Message.objects.filter(pk__in=flushed[i:i + SEEN_FLUSH_BATCH]).values_list('cell', 'author_id').distinct()
+			for cell, author_id in rows:
+				scopes.add(page_cache.block_scope(cell))
+				scopes.add(page_cache.user_scope(author_id))
+		page_cache.invalidate(*scopes)
+		message_cache.invalidate(flushed)
+	finally:
+		with _lock:
+			_flushing = {}
+
+
+# drop the buffered counts without writing them, e.g. before the database they were counted against goes away
+def discard():
+	with _lock:
+		_pending.clear()
+
+
+def _run_flusher():
+	while True:
+		time.sleep(SEEN_FLUSH_INTERVAL)
+		close_old_connections()
+		try:
+			flush()
+		except Exception as e:
+			socket_log.task("seen", "flush failed", error=e)
+		finally:
+			close_old_connections()
+
+
+def _start_flusher():
+	global _flusher
+	if _flusher is None:
+		with _lock:
+			if _flusher is None:
+				_flusher = threading.Thread(target=_run_flusher, name="drop-seen-flusher", daemon=True)
+				_flusher.start()
+				atexit.register(flush)
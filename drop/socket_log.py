@@ -0,0 +1,129 @@
+# sampled, non blocking log of websocket frames
+# sockets only put records on a bounded queue, a listener thread formats them as JSON lines and writes them to
+# stdout, so slow output never stalls a consumer and a full queue drops records instead of blocking. Frames are
+# written at their category's sample rate with payloads truncated to LOG_MAX_CHARS, while every frame is counted,
+# so log volume stays flat as traffic grows and stats() still shows all of it
+
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from .constants import LOG_SAMPLE_RATE, LOG_SAMPLE_RATES, LOG_MAX_CHARS, LOG_QUEUE_MAX
+
+logger = logging.getLogger("drop.socket")
+
+_lock = threading.Lock()
+_counters = {"received": {}, "sent": {}, "bytes_received": 0, "bytes_sent": 0, "events": 0, "logged": 0, "dropped": 0}
+_queue = queue.Queue(LOG_QUEUE_MAX)
+_listener = None
+
+
+# queue records as they are, formatting happens on the listener thread
+class _DroppingQueueHandler(QueueHandler):
+	def prepare(self, record):
+		return record
+
+	def enqueue(self, record):
+		try:
+			self.queue.put_nowait(record)
+		except queue.Full:
+			with _lock:
+				_counters["dropped"] += 1
+
+
+class _JsonFormatter(logging.Formatter):
+	def format(self, record):
+		fields = {"time": self.formatTime(record), "level": record.levelname}
+		if isinstance(record.msg, dict):
+			fields.update(record.msg)
+		else:
+			fields["message"] = record.getMessage()
+		return json.dumps(fields, default=str)
+
+
+_output = logging.StreamHandler(sys.stdout)
+_output.setFormatter(_JsonFormatter())
+logger.addHandler(_DroppingQueueHandler(_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+
+# start the listener thread writing queued records once per process
+def _start():
+	global _listener
+	if _listener is None:
+		with _lock:
+			if _listener is None:
+				_listener = QueueListener(_queue, _output)
+				_listener.start()
+
+
+def _sampled(category):
+	rate = LOG_SAMPLE_RATES.get(category, LOG_SAMPLE_RATE)
+	return rate >= 1 or random.random() < rate
+
+
+def _truncated(text):
+	if len(text) > LOG_MAX_CHARS:
+		return f"{text[:LOG_MAX_CHARS]}...(+{len(text) - LOG_MAX_CHARS})"
+	return text
+
+
+def _write(fields, level=logging.INFO):
+	_start()
+	with _lock:
+		_counters["logged"] += 1
+	logger.log(level, fields)
+
+
+def _count(direction, category, size):
+	with _lock:
+		counts = _counters[direction]
+		counts[category] = counts.get(category, 0) + 1
+		_counters[f"bytes_{direction}"] += size
+
+
+# frame and byte counts by category, and how many records were written or dropped, for this process
+def stats():
+	with _lock:
+		counters = dict(_counters)
+		counters["received"] = dict(counters["received"])
+		counters["sent"] = dict(counters["sent"])
+		return counters
+
+
+# a decoded client request, the access token is never written
+def received(username, code, request, size):
+	_count("received", code, size)
+	if _sampled(code):
+		data = {key: value for key, value in request.items() if key != "token"}
+		_write({"dir": "in", "user": username, "category": code, "bytes": size, "data": _truncated(json.dumps(data, default=str))})
+
+
+# an encoded frame sent to the client, binary frames are written as hex
+def sent(username, category, frame):
+	_count("sent", category, len(frame))
+	if _sampled(category):
+		data = frame[:LOG_MAX_CHARS // 2].hex() if isinstance(frame, bytes) else _truncated(frame)
+		level = logging.WARNING if category in ("error", "token") else logging.INFO
+		_write({"dir": "out", "user": username, "category": category, "bytes": len(frame), "data": data}, level)
+
+
+# background work of the process, e.g. an expiry sweep or a failed flush, written whatever the sample rates
+def task(name, event, error=None, **fields):
+	fields = dict({"task": name, "event": event}, **fields)
+	if error is not None:
+		fields["error"] = f"{error}"
+	_write(fields, logging.ERROR if error is not None else logging.INFO)
+
+
+# socket lifecycle, e.g. opened, authenticated or closed
+def event(username, name, **fields):
+	with _lock:
+		_counters["events"] += 1
+	if _sampled("socket"):
+		_write(dict({"event": name, "user": username}, **fields))
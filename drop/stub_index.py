@@ -0,0 +1,104 @@
+# in memory stub index of the messages in each geoblock
+# a block's stubs are parallel id / lat / long / expiry arrays loaded with one values query (no model instances)
+# and kept up to date as this process creates and deletes messages. The JSON sent for the block is built once
+# and reused until the block's stubs change or one of them expires. Blocks are reloaded after STUB_INDEX_TTL
+# seconds to pick up writes made by other processes, and the least recently used blocks are dropped past
+# STUB_INDEX_MAX_BLOCKS
+
+import json
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from drop.models import Message
+from .constants import STUB_INDEX_MAX_BLOCKS, STUB_INDEX_TTL
+from .encoding import Encoded
+
+_lock = threading.Lock()
+_blocks = OrderedDict()  # cell -> _BlockStubs, lru ordered
+
+
+class _BlockStubs:
+	def __init__(self, rows):
+		self.ids = array('q')
+		self.lats = array('d')
+		self.longs = array('d')
+		self.expires = array('d')  # unix timestamps
+		self.blob = None
+		for msg_id, lat, long, expires in rows:
+			self.add(msg_id, lat, long, expires)
+		self.loaded = time.monotonic()
+
+	def add(self, msg_id, lat, long, expires):
+		self.ids.append(msg_id)
+		self.lats.append(lat)
+		self.longs.append(long)
+		self.expires.append(expires.timestamp())
+		self.blob = None
+
+	def remove(self, msg_id):
+		try:
+			i = self.ids.index(msg_id)
+		except ValueError:
+			return
+		del self.ids[i], self.lats[i], self.longs[i], self.expires[i]
+		self.blob = None
+
+	# drop stubs of messages that have expired since they were loaded
+	def purge(self, timestamp):
+		live = [i for i, expires in enumerate(self.expires) if expires > timestamp]
+		if len(live) < len(self.ids):
+			self.ids = array('q', [self.ids[i] for i in live])
+			self.lats = array('d', [self.lats[i] for i in live])
+			self.longs = array('d', [self.longs[i] for i in live])
+			self.expires = array('d', [self.expires[i] for i in live])
+
+	def to_json(self):
+		timestamp = time.time()
+		if self.blob is None or timestamp >= self.next_expiry:
+			self.purge(timestamp)
+			self.next_expiry = min(self.expires, default=float("inf"))
+			self.blob = Encoded(json.dumps({
+				"id": self.ids.tolist(),
+				"lat": self.lats.tolist(),
+				"long": self.longs.tolist()
+			}, separators=(",", ":")))
+		return self.blob
+
+
+def _load(cell):
+	return _BlockStubs(Message.objects.live().filter(cell=cell).order_by('id').values_list('id', 'lat', 'long', 'expires'))
+
+
+# stubs of the block's messages as a JSON object of parallel arrays {id: [], lat: [], long: []}
+def get_json(cell):
+	with _lock:
+		block = _blocks.get(cell)
+		if block is not None and time.monotonic() - block.loaded < STUB_INDEX_TTL:
+			_blocks.move_to_end(cell)
+			return block.to_json()
+
+	# load outside the lock, a block loaded twice by racing sockets is harmless
+	block = _load(cell)
+	with _lock:
+		_blocks[cell] = block
+		_blocks.move_to_end(cell)
+		while len(_blocks) > STUB_INDEX_MAX_BLOCKS:
+			_blocks.popitem(last=False)
+		return block.to_json()
+
+
+# a message was created in the block, only blocks already in memory need to know
+def add(cell, msg_id, lat, long, expires):
+	with _lock:
+		block = _blocks.get(cell)
+		if block is not None:
+			block.add(msg_id, lat, long, expires)
+
+
+def remove(cell, msg_id):
+	with _lock:
+		block = _blocks.get(cell)
+		if block is not None:
+			block.remove(msg_id)
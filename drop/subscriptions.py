@@ -0,0 +1,78 @@
+# levels of the geoblock hierarchy that sockets are subscribed at
+# a post only notifies the groups of its cells at levels somebody listens at, instead of a channel layer publish
+# per level. Each process counts its own sockets by level and advertises the coarse levels (above 0, which is
+# always notified) in the NOTIFY_REGISTRY_ALIAS cache, refreshing them every NOTIFY_LEVEL_REFRESH seconds.
+# With more than one process the cache has to be shared (e.g. redis), like the page cache
+
+import threading
+import time
+
+from django.core.cache import caches
+from .constants import GEOLOC_LEVELS, NOTIFY_REGISTRY_ALIAS, NOTIFY_LEVEL_REFRESH
+from . import socket_log
+
+_lock = threading.Lock()
+_local = {}  # level -> sockets in this process subscribed at it
+_refresher = None
+
+
+def _key(level):
+	return f"notifylevel:{level}"
+
+
+def _advertise(levels):
+	if levels:
+		caches[NOTIFY_REGISTRY_ALIAS].set_many({_key(level): 1 for level in levels}, NOTIFY_LEVEL_REFRESH * 3)
+
+
+def joined(level):
+	with _lock:
+		_local[level] = _local.get(level, 0) + 1
+		first = _local[level] == 1
+
+	# other processes have to know straight away, not at the next refresh
+	if first and level > 0:
+		_advertise([level])
+		_start_refresher()
+
+
+def left(level):
+	with _lock:
+		sockets = _local.get(level, 0) - 1
+		if sockets > 0:
+			_local[level] = sockets
+		else:
+			_local.pop(level, None)
+
+
+# levels a new message has to be sent to, in order
+def active_levels():
+	with _lock:
+		levels = {level for level in _local}
+	levels.add(0)
+
+	remote = [level for level in range(1, GEOLOC_LEVELS + 1) if level not in levels]
+	if remote:
+		advertised = caches[NOTIFY_REGISTRY_ALIAS].get_many([_key(level) for level in remote])
+		levels.update(level for level in remote if _key(level) in advertised)
+	return sorted(levels)
+
+
+def _run_refresher():
+	while True:
+		time.sleep(NOTIFY_LEVEL_REFRESH)
+		try:
+			with _lock:
+				levels = [level for level in _local if level > 0]
+			_advertise(levels)
+		except Exception as e:
+			socket_log.task("subscriptions", "refresh failed", error=e)
+
+
+def _start_refresher():
+	global _refresher
+	if _refresher is None:
+		with _lock:
+			if _refresher is None:
+				_refresher = threading.Thread(target=_run_refresher, name="drop-subscription-refresher", daemon=True)
+				_refresher.start()
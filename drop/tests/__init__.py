@@ -0,0 +1,32 @@
+# tests of the drop app, python manage.py test drop
+
+from django.test import TestCase
+
+from drop import seen_counter, cell_aggregates, votes
+
+
+# seen counts, cell totals and votes buffered by a test belong to the test database, they're dropped before it
+# goes away so the flushers and atexit never write them to the configured one
+def discard_buffers():
+	seen_counter.discard()
+	cell_aggregates.discard()
+	votes.discard()
+
+
+# setUpTestData's buffered changes are written with the class's data, a test's own are dropped with its rollback
+class DropTestCase(TestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		seen_counter.flush()
+		cell_aggregates.flush()
+		votes.flush()
+
+	@classmethod
+	def tearDownClass(cls):
+		discard_buffers()
+		super().tearDownClass()
+
+	def tearDown(self):
+		discard_buffers()
+		super().tearDown()
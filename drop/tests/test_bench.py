@@ -0,0 +1,52 @@
+# benchmarks seed a throwaway database, the configured one must come out of a run untouched. The run is a separate
+# process against a database file so the flushers' atexit writes at the end of it are covered too
+
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+from django.test import SimpleTestCase
+
+SETTINGS = """
+from {module} import *
+DATABASES = {{"default": {{"ENGINE": "django.db.backends.sqlite3", "NAME": {name!r}}}}}
+"""
+
+CREATE_MESSAGE = """
+from django.contrib.auth.models import User
+from drop import message_facade as mf, cell_aggregates
+from drop.util import Geoloc
+mf.create_message(geoloc=Geoloc(-33.87, 151.21), message="real", author=User.objects.create_user("real"))
+cell_aggregates.flush()
+"""
+
+
+class BenchDatabaseTest(SimpleTestCase):
+	def django(self, directory, *args):
+		env = dict(os.environ, DJANGO_SETTINGS_MODULE="bench_test_settings")
+		env["PYTHONPATH"] = os.pathsep.join([directory] + sys.path)
+		subprocess.run([sys.executable, "-m", "django"] + list(args), env=env, check=True,
+			stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+	def snapshot(self, name):
+		with sqlite3.connect(name) as db:
+			return (
+				db.execute("SELECT id, votes, seen, message FROM drop_message ORDER BY id").fetchall(),
+				db.execute("SELECT level, key, messages, votes FROM drop_cellaggregate ORDER BY level, key").fetchall()
+			)
+
+	def test_bench_ws_leaves_database_untouched(self):
+		with tempfile.TemporaryDirectory() as directory:
+			name = os.path.join(directory, "real.sqlite3")
+			with open(os.path.join(directory, "bench_test_settings.py"), "w") as f:
+				f.write(SETTINGS.format(module=os.environ["DJANGO_SETTINGS_MODULE"], name=name))
+
+			self.django(directory, "migrate")
+			# a real message sharing ids with the seeded ones
+			self.django(directory, "shell", "-c", CREATE_MESSAGE)
+			before = self.snapshot(name)
+
+			self.django(directory, "bench_ws", "--clients", "2", "--ops", "20", "--messages", "50", "--blocks", "4")
+			self.assertEqual(self.snapshot(name), before)
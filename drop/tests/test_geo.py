@@ -0,0 +1,105 @@
+# cell keys, the cell key ranges covering a box of blocks and the range query built on them
+
+import random
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+
+from drop.geo import (
+	cell_key, cell_indexes, cell_ranges, parent_cell, child_range, lat_index, long_index, LAT_INDEX_MAX, LONG_INDEX_MAX
+)
+from drop.models import Message
+from drop.util import Geoloc
+from drop import message_facade as mf
+from . import DropTestCase
+
+
+class CellKeyTest(SimpleTestCase):
+	def test_indexes_round_trip(self):
+		rng = random.Random(0)
+		for _ in range(500):
+			lat_idx, long_idx = rng.randint(0, LAT_INDEX_MAX), rng.randint(0, LONG_INDEX_MAX)
+			self.assertEqual(cell_indexes(cell_key(lat_idx, long_idx)), (lat_idx, long_idx))
+
+	def test_parent_contains_block(self):
+		cell = cell_key(12345, 23456)
+		for level in range(1, 6):
+			lo, hi = child_range(parent_cell(cell, level), level)
+			self.assertTrue(lo <= cell <= hi, level)
+			self.assertEqual(cell_indexes(parent_cell(cell, level)), (12345 >> level, 23456 >> level))
+
+	def test_block_matches_cell(self):
+		# half way geolocations whose float rounding disagrees with the index rounding
+		points = [(40.275, 10), (1.005, 2.675), (-0.125, -179.995), (89.995, 179.995)]
+		rng = random.Random(1)
+		points += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(500)]
+		for lat, long in points:
+			block = Geoloc(lat, long).get_block()
+			self.assertEqual(cell_indexes(block.cell), (lat_index(block.lat), long_index(block.long)), (lat, long))
+			self.assertEqual(block.get_block().cell, block.cell, (lat, long))
+
+
+class CellRangesTest(SimpleTestCase):
+	def covered(self, ranges):
+		return lambda cell: any(lo <= cell <= hi for lo, hi in ranges)
+
+	def assertCovers(self, box, max_ranges=16):
+		lat_lo, lat_hi, long_lo, long_hi = box
+		ranges, exact = cell_ranges(*box, max_ranges=max_ranges)
+		self.assertLessEqual(len(ranges), max_ranges)
+		self.assertEqual(ranges, sorted(ranges))
+		covered = self.covered(ranges)
+		for lat_idx in range(lat_lo, lat_hi + 1):
+			for long_idx in range(long_lo, long_hi + 1):
+				self.assertTrue(covered(cell_key(lat_idx, long_idx)), (box, lat_idx, long_idx))
+		if exact:
+			# an exact cover keys no block outside the box
+			blocks = (hi - lo + 1 for lo, hi in ranges)
+			self.assertEqual(sum(blocks), (lat_hi - lat_lo + 1) * (long_hi - long_lo + 1), box)
+		return exact
+
+	def test_small_boxes(self):
+		rng = random.Random(2)
+		for _ in range(100):
+			lat_lo, long_lo = rng.randint(0, LAT_INDEX_MAX - 20), rng.randint(0, LONG_INDEX_MAX - 20)
+			self.assertCovers((lat_lo, lat_lo + rng.randint(0, 19), long_lo, long_lo + rng.randint(0, 19)))
+
+	def test_aligned_box_is_one_range(self):
+		ranges, exact = cell_ranges(64, 127, 128, 191)
+		self.assertEqual(ranges, [child_range(parent_cell(cell_key(64, 128), 6), 6)])
+		self.assertTrue(exact)
+
+	def test_merged_cover(self):
+		self.assertFalse(self.assertCovers((9000, 9012, 18000, 18030), max_ranges=2))
+
+	def test_long_box(self):
+		# long around enough to be covered with coarse quads
+		self.assertFalse(self.assertCovers((9000, 9002, 17000, 17400)))
+
+	def test_empty_box(self):
+		self.assertEqual(cell_ranges(10, 9, 0, 5), ([], True))
+
+
+class RangeQueryTest(DropTestCase):
+	@classmethod
+	def setUpTestData(cls):
+		author = User.objects.create_user("ranger")
+		rng = random.Random(3)
+		for i in range(80):
+			lat, long = round(rng.uniform(-33.95, -33.75), 4), round(rng.uniform(151.0, 151.4), 4)
+			mf.create_message(geoloc=Geoloc(lat, long), message=f"range {i}", author=author)
+
+	def test_range_matches_box(self):
+		# ranges 0.2 / 0.1 have to merge cell ranges and filter the extra blocks back out
+		for lat, long, geoloc_range in [(-33.87, 151.21, 0.02), (-33.85, 151.2, 0.1), (-33.8, 151.3, 0.2)]:
+			block = Geoloc(lat, long).get_block()
+			lat_c, long_c = lat_index(block.lat), long_index(block.long)
+			lat_reach, long_reach = round(geoloc_range / 2 * 100), round(geoloc_range * 100)
+			expected = {
+				m.pk for m in Message.objects.all()
+				if abs(lat_index(m.lat_block) - lat_c) <= lat_reach and abs(long_index(m.long_block) - long_c) <= long_reach
+			}
+			paginator = mf.retrieve_messages_range(Geoloc(lat, long), geoloc_range)
+			found = {m.pk for m in paginator.object_list}
+			self.assertEqual(found, expected, (lat, long, geoloc_range))
+			self.assertTrue(expected, (lat, long, geoloc_range))
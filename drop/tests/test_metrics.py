@@ -0,0 +1,53 @@
+# access to the metrics endpoint and what it exports
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from drop import metrics
+from drop.util import Geoloc
+
+
+@override_settings(METRICS_TOKEN="scraper")
+class MetricsEndpointTest(TestCase):
+	def test_needs_token_or_staff(self):
+		self.assertEqual(self.client.get("/metrics").status_code, 401)
+		self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+		self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scraper").status_code, 200)
+
+		self.client.force_login(User.objects.create_user("member"))
+		self.assertEqual(self.client.get("/metrics").status_code, 401)
+		self.client.force_login(User.objects.create_user("admin", is_staff=True))
+		self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+	def test_stats_need_token_or_staff(self):
+		response = self.client.get("/api/stats/")
+		self.assertEqual(response.status_code, 401)
+		self.assertEqual(response["WWW-Authenticate"], 'Bearer realm="metrics"')
+		self.assertEqual(self.client.get("/api/stats/", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+		response = self.client.get("/api/stats/", HTTP_AUTHORIZATION="Bearer scraper")
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(set(response.json()), {"page_cache", "expiry", "socket_log"})
+
+		self.client.force_login(User.objects.create_user("member"))
+		self.assertEqual(self.client.get("/api/stats/").status_code, 401)
+		self.client.force_login(User.objects.create_user("admin", is_staff=True))
+		self.assertEqual(self.client.get("/api/stats/").status_code, 200)
+
+	def test_group_sockets_not_labelled(self):
+		block = Geoloc(-33.87, 151.21).get_block_name()
+		cell = Geoloc(-10, 37.8).get_block_name(2)
+		metrics.group_joined(block, "a")
+		metrics.group_joined(block, "b")
+		metrics.group_joined(cell, "a")
+		try:
+			text = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scraper").content.decode()
+		finally:
+			metrics.group_left(block, "a")
+			metrics.group_left(block, "b")
+			metrics.group_left(cell, "a")
+		self.assertNotIn(block, text)
+		self.assertNotIn(cell, text)
+		self.assertNotIn("group=", text)
+		self.assertIn('drop_group_sockets_bucket{le="1"} 1', text)
+		self.assertIn('drop_group_sockets_bucket{le="2"} 2', text)
+		self.assertIn("drop_group_sockets_sum 3", text)
@@ -0,0 +1,81 @@
+# distance searches checked against a brute force haversine over every message
+
+import random
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+
+from drop import nearby
+from drop.constants import NEAREST_MAX_BLOCKS
+from drop.geo import lat_index, long_index
+from drop.models import Message
+from drop.util import Geoloc
+from drop import message_facade as mf
+from . import DropTestCase
+
+
+class AntimeridianSearchTest(DropTestCase):
+	@classmethod
+	def setUpTestData(cls):
+		author = User.objects.create_user("antimeridian")
+		rng = random.Random(0)
+		points = [(-0.0005, 179.998), (0.001, -179.9975), (0.002, 179.99)]
+		points += [(rng.uniform(-0.05, 0.05), rng.choice([-1, 1]) * rng.uniform(179.95, 180)) for _ in range(60)]
+		for i, (lat, long) in enumerate(points):
+			mf.create_message(geoloc=Geoloc(round(lat, 6), round(long, 6)), message=f"antimeridian {i}", author=author)
+
+	def brute_force(self, lat, long):
+		rows = np.array(list(Message.objects.values_list("id", "lat", "long")), dtype=np.float64)
+		return rows[:, 0].astype(np.int64), nearby.haversine_km(lat, long, rows[:, 1], rows[:, 2])
+
+	def test_within_crosses_antimeridian(self):
+		for lat, long in [(0, -179.999), (0, -180), (0, 180), (-0.0005, 179.998), (0.03, 179.97)]:
+			for radius_km in (0.5, 2, 8):
+				ids, distances = self.brute_force(lat, long)
+				expected = set(ids[distances <= radius_km].tolist())
+				found, _ = nearby.within(lat, long, radius_km)
+				self.assertEqual(set(found.tolist()), expected, (lat, long, radius_km))
+
+	def test_nearest_crosses_antimeridian(self):
+		for lat, long in [(0, -179.999), (0, -180), (0, 180), (0.03, 179.97)]:
+			for k in (1, 5, 20):
+				ids, distances = self.brute_force(lat, long)
+				expected = np.sort(distances)[:k]
+				_, found = nearby.nearest(lat, long, k)
+				np.testing.assert_allclose(found, expected, err_msg=str((lat, long, k)))
+
+
+class HighLatitudeSearchTest(DropTestCase):
+	searches = [(60, 10), (75, -120), (89.9, 45)]
+
+	@classmethod
+	def setUpTestData(cls):
+		author = User.objects.create_user("polar")
+		rng = random.Random(1)
+		# within NEAREST_MAX_BLOCKS of the searches, longitudes bunch up towards the pole
+		points = [(min(90, rng.uniform(lat - 3, lat + 3)), rng.uniform(-180, 180) if lat > 85 else rng.uniform(long - 20, long + 20))
+			for lat, long in cls.searches for _ in range(30)]
+		for i, (lat, long) in enumerate(points):
+			mf.create_message(geoloc=Geoloc(round(lat, 6), round(long, 6)), message=f"polar {i}", author=author)
+
+	def test_nearest_near_pole(self):
+		rows = np.array(list(Message.objects.values_list("lat", "long")), dtype=np.float64)
+		for lat, long in self.searches:
+			for k in (1, 5, 20):
+				expected = np.sort(nearby.haversine_km(lat, long, rows[:, 0], rows[:, 1]))[:k]
+				_, found = nearby.nearest(lat, long, k)
+				np.testing.assert_allclose(found, expected, err_msg=str((lat, long, k)))
+
+	# every ring out to NEAREST_MAX_BLOCKS, the rings near the poles wrap the whole map around
+	def test_ring_covers_are_cheap(self):
+		for lat in (60, 75, 89.9):
+			start = time.perf_counter()
+			inner, radius = None, 0
+			while True:
+				outer = nearby.ring_reach(lat, radius)
+				nearby.in_boxes(nearby.ring_boxes(lat_index(lat), long_index(10), inner, outer))
+				if radius >= NEAREST_MAX_BLOCKS:
+					break
+				inner, radius = outer, min(NEAREST_MAX_BLOCKS, radius * 2 + 1)
+			self.assertLess(time.perf_counter() - start, 0.25, lat)
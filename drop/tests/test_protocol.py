@@ -0,0 +1,184 @@
+# cursor paging and held searches through a websocket, against the thread per frame and async consumers
+
+import base64
+import json
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from rest_framework_jwt.settings import api_settings
+
+from dropmessages.routing import application
+from drop.constants import PAGE_SIZE
+from drop.util import Geoloc
+from drop import message_facade as mf
+from . import discard_buffers
+
+HERE = (-33.87, 151.21)
+
+
+def token(user):
+	return api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(user))
+
+
+def tamper(cursor, **changes):
+	fields = dict(zip(("ordering", "key", "msg_id"), json.loads(base64.urlsafe_b64decode(cursor.encode()))))
+	fields.update(changes)
+	raw = json.dumps([fields["ordering"], fields["key"], fields["msg_id"]])
+	return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+# the database is shared with the consumers' threads, so the tests commit
+class SocketTestCase(TransactionTestCase):
+	path = "/ws/sync/"
+
+	def setUp(self):
+		self.author = User.objects.create_user("pager")
+		for i in range(PAGE_SIZE * 2 + 5):
+			m = mf.create_message(geoloc=Geoloc(*HERE), message=f"page {i}", author=self.author)
+			for _ in range(i % 4):
+				mf.upvote(m.pk)
+
+	def tearDown(self):
+		discard_buffers()
+		super().tearDown()
+
+	def run_socket(self, session):
+		async def run():
+			socket = WebsocketCommunicator(application, self.path)
+			connected, _ = await socket.connect()
+			self.assertTrue(connected)
+			await socket.send_json_to({"category": 11, "token": token(self.author), "lat": HERE[0], "long": HERE[1]})
+			self.assertEqual(await self.receive(socket), ("socket", "open"))
+			try:
+				await session(socket)
+			finally:
+				await socket.disconnect()
+		async_to_sync(run)()
+
+	async def receive(self, socket):
+		frame = await socket.receive_json_from(timeout=5)
+		data = frame["data"]
+		try:
+			data = json.loads(data)
+		except ValueError:
+			pass
+		return frame["category"], data
+
+	async def request(self, socket, frame):
+		await socket.send_json_to(frame)
+		return await self.receive(socket)
+
+	async def cursor_page(self, socket, code, cursor):
+		category, page = await self.request(socket, {"category": code, "cursor": cursor})
+		self.assertEqual(category, "page")
+		return [m["id"] for m in page["messages"]], page["cursor"]
+
+	async def all_pages(self, socket, code, between=None):
+		ids, cursor = await self.cursor_page(socket, code, "")
+		while cursor:
+			if between:
+				await between()
+			page, cursor = await self.cursor_page(socket, code, cursor)
+			ids += page
+		return ids
+
+	async def post(self, text):
+		return await database_sync_to_async(mf.create_message)(geoloc=Geoloc(*HERE), message=text, author=self.author)
+
+
+class CursorPagingTest(SocketTestCase):
+	def test_stable_while_posting(self):
+		async def session(socket):
+			for code in (2, 3, 6, 17):
+				expected = await self.all_pages(socket, code)
+				self.assertGreaterEqual(len(expected), PAGE_SIZE * 2 + 5, code)
+
+				posted = []
+				async def between():
+					posted.append((await self.post(f"late {code} {len(posted)}")).pk)
+				ids = await self.all_pages(socket, code, between)
+
+				# nothing repeats or goes missing, posts only show up past the cursor when they sort there,
+				# never in the newest first listings
+				self.assertEqual(len(ids), len(set(ids)), code)
+				self.assertEqual([i for i in ids if i not in posted], expected, code)
+				if code in (3, 6):
+					self.assertFalse(set(ids) & set(posted), code)
+		self.run_socket(session)
+
+	def test_bad_cursors_get_first_page(self):
+		async def session(socket):
+			first, cursor = await self.cursor_page(socket, 3, "")
+			ranked, _ = await self.cursor_page(socket, 2, "")
+			hot, _ = await self.cursor_page(socket, 17, "")
+			bad = [
+				"garbage", "!!!", 12, None, [], {"a": 1},
+				base64.urlsafe_b64encode(b"[1,2]").decode(),
+				tamper(cursor, key="yesterday"),
+				tamper(cursor, key=None),
+				tamper(cursor, msg_id="1"),
+				tamper(cursor, msg_id=True),
+				tamper(cursor, ordering="nonsense")
+			]
+			for bad_cursor in bad:
+				self.assertEqual((await self.cursor_page(socket, 3, bad_cursor))[0], first, bad_cursor)
+				self.assertEqual((await self.cursor_page(socket, 6, bad_cursor))[0], first, bad_cursor)
+
+			# a cursor from another listing, or with the key of another listing's type
+			self.assertEqual((await self.cursor_page(socket, 2, cursor))[0], ranked)
+			self.assertEqual((await self.cursor_page(socket, 2, tamper(cursor, ordering="ranked")))[0], ranked)
+			self.assertEqual((await self.cursor_page(socket, 17, tamper(cursor, ordering="hot")))[0], hot)
+
+			# the socket still pages normally afterwards
+			self.assertEqual(len((await self.cursor_page(socket, 3, cursor))[0]), PAGE_SIZE)
+		self.run_socket(session)
+
+
+class AsyncCursorPagingTest(CursorPagingTest):
+	path = "/ws/async/"
+
+
+class HeldSearchTest(SocketTestCase):
+	def setUp(self):
+		super().setUp()
+		# a page of messages in the blocks next to ours, inside a range of 0.02 but not of 0
+		for i in range(PAGE_SIZE):
+			mf.create_message(geoloc=Geoloc(HERE[0] + 0.01, HERE[1] - 0.01), message=f"next door {i}", author=self.author)
+
+	async def range_page(self, socket, geoloc_range, page):
+		category, messages = await self.request(socket, {"category": 5, "data": geoloc_range, "page": page})
+		self.assertEqual(category, "retrieve")
+		return [m["id"] for m in messages]
+
+	def test_later_page_continues_search(self):
+		async def session(socket):
+			await self.range_page(socket, 0, 1)
+			# page 2 of the held search in our block only, whatever the data says
+			self.assertEqual(len(await self.range_page(socket, 0.02, 2)), PAGE_SIZE)
+			self.assertEqual(len(await self.range_page(socket, 0.02, 3)), 5)
+		self.run_socket(session)
+
+	def test_other_listing_starts_new_search(self):
+		async def session(socket):
+			for between in (
+				{"category": 3, "page": 1},
+				{"category": 2, "cursor": ""},
+				{"category": 4, "page": 1},
+				{"category": 1, "lat": HERE[0], "long": HERE[1]}
+			):
+				await self.range_page(socket, 0, 1)
+				await self.request(socket, between)
+				# a new search over the wider range, 35 messages
+				self.assertEqual(len(await self.range_page(socket, 0.02, 4)), 5, between)
+		self.run_socket(session)
+
+	def test_other_requests_keep_search(self):
+		async def session(socket):
+			ids = await self.range_page(socket, 0, 1)
+			await self.request(socket, {"category": 12, "data": ids[0]})
+			await self.request(socket, {"category": 7, "data": ids[0]})
+			self.assertEqual(len(await self.range_page(socket, 0.02, 3)), 5)
+		self.run_socket(session)
@@ -0,0 +1,104 @@
+# vote writes, straight to the db and coalesced, and deletion at DELETE_THRESH
+
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from drop import votes
+from drop.constants import DELETE_THRESH
+from drop.models import Message, hot_score
+from drop.util import Geoloc
+from drop import message_facade as mf
+from . import DropTestCase
+
+
+class VotesTestCase(DropTestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.author = User.objects.create_user("voter")
+
+	def post(self, text):
+		return mf.create_message(geoloc=Geoloc(-33.87, 151.21), message=text, author=self.author)
+
+	def votes_of(self, m):
+		return Message.objects.get(pk=m.pk).votes
+
+
+class VotesTest(VotesTestCase):
+	def test_votes_add_to_the_db_count(self):
+		m = self.post("atomic")
+		# a vote written by another process meanwhile isn't overwritten
+		Message.objects.filter(pk=m.pk).update(votes=10)
+		self.assertEqual(votes.vote(m.pk, 1), 11)
+		self.assertEqual(votes.vote(m.pk, -1), 10)
+		m = Message.objects.get(pk=m.pk)
+		self.assertEqual(m.votes, 10)
+		self.assertAlmostEqual(m.hot, hot_score(10, m.date))
+
+	def test_missing_message(self):
+		self.assertIsNone(votes.vote(999999, 1))
+
+	def test_deleted_at_threshold(self):
+		m = self.post("doomed")
+		for count in range(0, DELETE_THRESH, -1):
+			self.assertEqual(votes.vote(m.pk, -1), count)
+		self.assertEqual(votes.vote(m.pk, -1), DELETE_THRESH)
+		self.assertFalse(Message.objects.filter(pk=m.pk).exists())
+		self.assertIsNone(votes.vote(m.pk, -1))
+
+	def test_write_batches(self):
+		messages = [self.post(f"batch {i}") for i in range(5)]
+		with mock.patch.object(votes, "VOTE_WRITE_BATCH", 2), CaptureQueriesContext(connection) as queries:
+			result = votes.apply_votes({m.pk: 1 for m in messages})
+		self.assertEqual(result, {m.pk: 2 for m in messages})
+		updates = [q["sql"] for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+		# 3 vote updates and 3 hot rank updates of at most 2 messages each
+		self.assertEqual(len(updates), 6)
+
+
+@mock.patch.object(votes, "VOTE_COALESCE_INTERVAL", 1)
+@mock.patch.object(votes, "_start_flusher", lambda: None)
+class CoalescedVotesTest(VotesTestCase):
+	def test_coalesced_into_one_write(self):
+		m = self.post("burst")
+		# the first vote is written straight away, it tells us the count
+		self.assertEqual(votes.vote(m.pk, 1), 2)
+		self.assertEqual([votes.vote(m.pk, 1) for _ in range(3)], [3, 4, 5])
+		self.assertEqual(self.votes_of(m), 2)
+
+		with CaptureQueriesContext(connection) as queries:
+			votes.flush()
+		self.assertEqual(self.votes_of(m), 5)
+		self.assertEqual(len([q for q in queries.captured_queries if q["sql"].startswith("UPDATE")]), 2)
+
+	def test_deleted_message_is_forgotten(self):
+		m = self.post("gone")
+		self.assertEqual(votes.vote(m.pk, 1), 2)
+		Message.objects.filter(pk=m.pk).delete()
+		votes.vote(m.pk, 1)
+		votes.flush()
+		self.assertNotIn(m.pk, votes._known)
+		self.assertIsNone(votes.vote(m.pk, 1))
+
+	def test_threshold_reached_by_a_flush(self):
+		m = self.post("sunk")
+		self.assertEqual(votes.vote(m.pk, -1), 0)
+		for _ in range(-DELETE_THRESH):
+			votes.vote(m.pk, -1)
+		self.assertTrue(Message.objects.filter(pk=m.pk).exists())
+		votes.flush()
+		self.assertFalse(Message.objects.filter(pk=m.pk).exists())
+		self.assertNotIn(m.pk, votes._known)
+
+	def test_failed_flush_keeps_votes(self):
+		m = self.post("retry")
+		votes.vote(m.pk, 1)
+		votes.vote(m.pk, 1)
+		with mock.patch.object(votes, "_update_returning", side_effect=RuntimeError("db down")):
+			with self.assertRaises(RuntimeError):
+				votes.flush()
+		self.assertEqual(votes.vote(m.pk, 1), 4)
+		votes.flush()
+		self.assertEqual(self.votes_of(m), 4)
@@ -0,0 +1,105 @@
+# cache of verified socket tokens
+# a token is decoded and its user loaded once, later authentications with the same token are served from
+# memory until the token expires. The token is verified again every TOKEN_REVALIDATE_SECONDS so deleted or
+# disabled accounts, and tokens revoked by a new JWT_GET_USER_SECRET_KEY, are locked out within that window.
+# Reconnect storms then cost a dict lookup per socket
+
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.contrib.auth import get_user_model
+from rest_framework_jwt import utils as jwt_utils
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.settings import api_settings
+
+from .constants import TOKEN_CACHE_MAX, TOKEN_REVALIDATE_SECONDS
+from .custom_exceptions import TokenError
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # token -> (user, expires at or None, checked at), lru ordered
+
+
+# the token's claims, verified with a single decode when the signing key doesn't depend on the user
+def _decode(token):
+	if api_settings.JWT_GET_USER_SECRET_KEY or api_settings.JWT_DECODE_HANDLER is not jwt_utils.jwt_decode_token:
+		return JSONWebTokenAuthentication.jwt_decode_token(token)
+
+	return jwt.decode(
+		token, api_settings.JWT_PUBLIC_KEY or api_settings.JWT_SECRET_KEY,
+		api_settings.JWT_VERIFY, options={'verify_exp': api_settings.JWT_VERIFY_EXPIRATION},
+		leeway=api_settings.JWT_LEEWAY, audience=api_settings.JWT_AUDIENCE,
+		issuer=api_settings.JWT_ISSUER, algorithms=[api_settings.JWT_ALGORITHM]
+	)
+
+
+def _active_user(**lookup):
+	try:
+		user = get_user_model().objects.get(**lookup)
+	except get_user_model().DoesNotExist:
+		raise TokenError("User doesn't exist")
+	if not user.is_active:
+		raise TokenError("User account is disabled")
+	return user
+
+
+def _verify(token):
+	try:
+		payload = _decode(token)
+	except jwt.ExpiredSignature:
+		raise TokenError("Token has expired")
+	except jwt.InvalidTokenError:
+		raise TokenError("Error decoding token")
+
+	username = JSONWebTokenAuthentication.jwt_get_username_from_payload(payload)
+	if not username:
+		raise TokenError("Invalid token")
+	user = _active_user(**{get_user_model().USERNAME_FIELD: username})
+
+	expires = payload.get('exp') if api_settings.JWT_VERIFY_EXPIRATION else None
+	if expires is not None:
+		expires += api_settings.JWT_LEEWAY
+	return user, expires
+
+
+def _forget(token):
+	with _lock:
+		_entries.pop(token, None)
+
+
+# the user a token authenticates, raises TokenError for invalid or expired tokens
+def authenticate(token):
+	if not isinstance(token, str) or not token:
+		raise TokenError("Invalid access token")
+
+	timestamp = time.time()
+	with _lock:
+		entry = _entries.get(token)
+		if entry is not None:
+			_entries.move_to_end(token)
+
+	if entry is not None:
+		user, expires, checked = entry
+		if expires is not None and timestamp >= expires:
+			_forget(token)
+			raise TokenError("Token has expired")
+
+		if timestamp - checked < TOKEN_REVALIDATE_SECONDS:
+			return user
+
+		# verify the token again, the user's signing key may have been rotated as well as the account changed
+		try:
+			user, expires = _verify(token)
+		except TokenError:
+			_forget(token)
+			raise
+	else:
+		user, expires = _verify(token)
+
+	with _lock:
+		_entries[token] = (user, expires, timestamp)
+		_entries.move_to_end(token)
+		while len(_entries) > TOKEN_CACHE_MAX:
+			_entries.popitem(last=False)
+	return user
@@ -1,16 +1,14 @@
 # utility functions
 # Jeremy Vun 2726092
 
-from drop.models import Message
-from .constants import GEOLOC_RESOLUTION, MAX_MESSAGE_LENGTH, MAX_RANGE
-
+import base64
+import json
 
-class Stub:
-	def __init__(self, id, author, lat, long):
-		self.id = id
-		self.author = author
-		self.lat = lat
-		self.long = long
+from django.utils.dateparse import parse_datetime
+from drop.models import Message
+from .constants import GEOLOC_RESOLUTION, MAX_MESSAGE_LENGTH, MAX_RANGE, MAX_RADIUS_KM, MAX_NEAREST, PAGE_SIZE
+from .geo import cell_key, index_lat, index_long, lat_index, long_index, parent_cell
+from . import message_cache
 
 
 class Geoloc:
@@ -21,15 +19,20 @@ class Geoloc:
 	def is_valid(self):
 		return -90 <= self.lat <= 90 and 180 >= self.long >= -180
 
+	# the geoblock containing this geolocation, with its integer cell key. Both come from the same block
+	# indexes, rounding the degrees on their own can land a half way geolocation in the next block over
 	def get_block(self):
-		return Geoloc(
-			round(self.lat, GEOLOC_RESOLUTION),
-			round(self.long, GEOLOC_RESOLUTION)
-		)
+		lat_idx, long_idx = lat_index(self.lat), long_index(self.long)
+		block = Geoloc(index_lat(lat_idx), index_long(long_idx))
+		block.cell = cell_key(lat_idx, long_idx)
+		return block
+
+	# cell key of the geoblock, or of the cell containing it at a coarser level
+	def get_cell(self, level=0):
+		return parent_cell(self.get_block().cell, level)
 
-	def get_block_name(self):
-		block = self.get_block()
-		return f"{block.lat}-{block.long}"
+	def get_block_name(self, level=0):
+		return block_name(self.get_cell(level), level)
 
 	def get_block_string(self):
 		return str(self.get_block())
@@ -38,6 +41,13 @@ class Geoloc:
 		return f"{round(self.lat, GEOLOC_RESOLUTION)},{round(self.long, GEOLOC_RESOLUTION)}"
 
 
+# channel layer group / cache scope name of a geoblock, or of a cell at a coarser level
+def block_name(cell, level=0):
+	if level:
+		return f"block-L{level}-{cell}"
+	return f"block-{cell}"
+
+
 # lat,long
 def parse_geoloc(lat_str, long_str):
 	try:
@@ -46,7 +56,6 @@ def parse_geoloc(lat_str, long_str):
 		if geoloc.is_valid():
 			return geoloc
 		else:
-			print("geoloc not valid")
 			return None
 	except ValueError:
 		return None
@@ -63,20 +72,39 @@ def parse_message(m):
 # serialize message into json
 def serialize_message(m):
 	if isinstance(m, Message):
-		result = {
-			"id": m.pk,
-			"author": m.author.username,
-			"lat": m.lat,
-			"long": m.long,
-			"date": m.date.strftime("%d/%m/%Y"),
-			"message": m.message,
-			"votes": m.votes,
-			"seen": m.seen
-		}
+		# serialized forms are shared through the message cache, never modify one in place
+		result = message_cache.get(m.pk, m.votes, m.seen)
+		if result is None:
+			result = {
+				"id": m.pk,
+				"author": m.author.username,
+				"lat": m.lat,
+				"long": m.long,
+				"date": m.date.strftime("%d/%m/%Y"),
+				"message": m.message,
+				"votes": m.votes,
+				"seen": m.seen
+			}
+			message_cache.put(m.pk, m.votes, m.seen, result)
+
+		# km from the searched geolocation, set on messages returned by a distance search
+		distance = getattr(m, "distance", None)
+		if distance is not None:
+			result = dict(result, distance=round(distance, 3))
 		return result
 	return None
 
 
+# serialize an iterable of messages, skipping anything that isn't one
+def serialize_messages(qs):
+	result = []
+	for m in qs:
+		m_json = serialize_message(m)
+		if m_json:
+			result.append(m_json)
+	return result
+
+
 def parse_coord_range(coord_range):
 	try:
 		result = round(float(coord_range), GEOLOC_RESOLUTION)
@@ -89,6 +117,54 @@ def parse_coord_range(coord_range):
 		return 0.0
 
 
+# search radius in km
+def parse_radius(radius):
+	try:
+		result = float(radius)
+		if not result > 0:
+			result = 0.0
+		elif result > MAX_RADIUS_KM:
+			result = float(MAX_RADIUS_KM)
+		return result
+	except (TypeError, ValueError):
+		return 0.0
+
+
+# number of nearest messages to search for
+def parse_nearest(k):
+	try:
+		return min(max(int(k), 1), MAX_NEAREST)
+	except (TypeError, ValueError):
+		return PAGE_SIZE
+
+
+# opaque keyset pagination cursor: the ordering plus the (sort key, id) of the last message served
+def encode_cursor(ordering, key, msg_id):
+	if hasattr(key, "isoformat"):
+		key = key.isoformat()
+	raw = json.dumps([ordering, key, msg_id], separators=(",", ":"))
+	return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+# decode a cursor issued for the ordering, None for a first page request or a cursor we didn't issue
+def decode_cursor(cursor, ordering):
+	try:
+		if not cursor:
+			return None
+		cursor_ordering, key, msg_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+		if cursor_ordering != ordering:
+			return None
+		if ordering == "new":
+			key = parse_datetime(key)
+		elif isinstance(key, bool) or not isinstance(key, (int, float)):
+			key = None
+		if key is None or isinstance(msg_id, bool) or not isinstance(msg_id, int):
+			return None
+		return key, msg_id
+	except (ValueError, TypeError, AttributeError):
+		return None
+
+
 def parse_int(x):
 	try:
 		result = int(x)
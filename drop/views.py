@@ -1,11 +1,16 @@
 # Views for web based end points
 # Jeremy Vun 2726092
 
+import hmac
+
+from django.conf import settings
 from django.shortcuts import render, redirect
+from django.http import JsonResponse, HttpResponse
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 
 from .serializers import UserSerializer
+from . import page_cache, expiry, socket_log, metrics
 from rest_framework.generics import CreateAPIView
 from rest_framework import permissions
 
@@ -42,6 +47,39 @@ def web_register(request):
 	return render(request, template, context)
 
 
+# staff sessions and requests with the METRICS_TOKEN as bearer token
+def _metrics_allowed(request):
+	if request.user.is_authenticated and request.user.is_staff:
+		return True
+	token = getattr(settings, "METRICS_TOKEN", None)
+	header = request.META.get("HTTP_AUTHORIZATION", "")
+	return bool(token) and header.startswith("Bearer ") and hmac.compare_digest(header[len("Bearer "):], token)
+
+
+def _metrics_denied():
+	response = HttpResponse("Metrics need a bearer token or a staff login", status=401, content_type="text/plain")
+	response["WWW-Authenticate"] = 'Bearer realm="metrics"'
+	return response
+
+
+# in process counters of the websocket api's caches, staff or the METRICS_TOKEN bearer only
+def api_stats(request):
+	if not _metrics_allowed(request):
+		return _metrics_denied()
+	return JsonResponse({
+		"page_cache": page_cache.stats(),
+		"expiry": expiry.stats(),
+		"socket_log": socket_log.stats()
+	})
+
+
+# websocket api metrics for prometheus to scrape, staff or the METRICS_TOKEN bearer only
+def api_metrics(request):
+	if not _metrics_allowed(request):
+		return _metrics_denied()
+	return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # generic model view for creating models via REST API
 class RegisterUserView(CreateAPIView):
 	serializer_class = UserSerializer
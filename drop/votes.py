@@ -0,0 +1,202 @@
+# atomic vote writes with optional coalescing
+# votes are applied as votes = votes + delta in the db, never read-modify-save, so concurrent votes can't be lost.
+# the hot rank follows in a second statement that only lands if the votes haven't moved on since.
+# With VOTE_COALESCE_INTERVAL set, votes on messages we already know the count of are buffered and
+# bursts on the same message are merged into one write per tick
+
+import atexit
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.db import connection, close_old_connections, transaction
+from functools import reduce
+from operator import or_
+
+from django.db.models import F, Q, Case, When, Value, FloatField
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now, is_naive, make_aware, utc
+from drop.models import Message, hot_score
+from .constants import DELETE_THRESH, VOTE_COALESCE_INTERVAL, VOTE_KNOWN_MAX, VOTE_WRITE_BATCH
+from . import page_cache, cell_aggregates, stub_index, message_cache, socket_log
+
+_lock = threading.Lock()
+_pending = {}  # msg id -> vote delta not yet written
+_flushing = {}  # deltas being written, still projected until they commit
+_known = OrderedDict()  # msg id -> votes after our last write, lru bounded by VOTE_KNOWN_MAX
+_flusher = None
+
+
+# apply a vote to a message, returns its (projected) vote count or None if it doesn't exist
+def vote(msg_id, delta):
+	if VOTE_COALESCE_INTERVAL:
+		projected = _buffer(msg_id, delta)
+		if projected is not None:
+			return projected
+
+	# first vote we see on a message is written straight away, it tells us the message exists and its count
+	return apply_votes({msg_id: delta}).get(msg_id)
+
+
+# write vote deltas, one UPDATE per distinct delta (and VOTE_WRITE_BATCH messages), then delete messages voted
+# down to DELETE_THRESH. returns msg id -> new votes for the messages that exist
+def apply_votes(deltas):
+	by_delta = defaultdict(list)
+	for msg_id, delta in deltas.items():
+		if delta:
+			by_delta[delta].append(msg_id)
+
+	rows = []
+	for delta, msg_ids in by_delta.items():
+		for i in range(0, len(msg_ids), VOTE_WRITE_BATCH):
+			rows += _update_returning(msg_ids[i:i + VOTE_WRITE_BATCH], delta)
+
+	result = {}
+	doomed = []
+	scopes = set()
+	hot = {}
+	aggregates = defaultdict(lambda: [0, 0, None])
+	for msg_id, votes, cell, author_id, date in rows:
+		result[msg_id] = votes
+		hot[msg_id] = (votes, hot_score(votes, _returned_datetime(date)))
+		aggregates[cell][1] += deltas[msg_id]
+		if votes <= DELETE_THRESH:
+			doomed.append((cell, msg_id))
+			aggregates[cell][0] -= 1
+			aggregates[cell][1] -= votes
+		scopes.add(page_cache.block_scope(cell))
+		scopes.add(page_cache.user_scope(author_id))
+
+	# the returned counts already tell us what crossed the threshold, the delete re-checks it in the db
+	doomed_ids = {msg_id for _, msg_id in doomed}
+	for i in range(0, len(doomed), VOTE_WRITE_BATCH):
+		batch = [msg_id for _, msg_id in doomed[i:i + VOTE_WRITE_BATCH]]
+		Message.objects.filter(pk__in=batch, votes__lte=DELETE_THRESH).delete()
+	_update_hot({msg_id: hot[msg_id] for msg_id in hot if msg_id not in doomed_ids})
+
+	for cell, msg_id in doomed:
+		stub_index.remove(cell, msg_id)
+	with _lock:
+		for msg_id in deltas:
+			# messages that are gone (deleted, expired) are forgotten so their next vote goes to the db
+			_remember(msg_id, None if msg_id in doomed_ids else result.get(msg_id))
+	cell_aggregates.record(aggregates)
+	page_cache.invalidate(*scopes)
+	message_cache.invalidate(result)
+	return result
+
+
+def supports_returning():
+	return connection.vendor == "postgresql" or (connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 35))
+
+
+# votes = votes + delta for the live messages of the ids, returns (id, votes, cell, author_id, date) of updated rows
+def _update_returning(msg_ids, delta):
+	if supports_returning():
+		table = connection.ops.quote_name(Message._meta.db_table)
+		placeholders = ", ".join(["%s"] * len(msg_ids))
+		with connection.cursor() as cursor:
+			cursor.execute(
+				f"UPDATE {table} SET votes = votes + %s WHERE id IN ({placeholders}) AND expires > %s "
+				f"RETURNING id, votes, cell, author_id, date",
+				[delta] + list(msg_ids) + [connection.ops.adapt_datetimefield_value(now())]
+			)
+			return cursor.fetchall()
+
+	# no RETURNING, read our own write back inside the same transaction while the rows are locked
+	with transaction.atomic():
+		msg_ids = list(Message.objects.live().filter(pk__in=msg_ids).values_list('id', flat=True))
+		Message.objects.filter(pk__in=msg_ids).update(votes=F('votes') + delta)
+		return list(Message.objects.filter(pk__in=msg_ids).values_list('id', 'votes', 'cell', 'author_id', 'date'))
+
+
+# raw cursors hand back datetimes as strings on some backends
+def _returned_datetime(value):
+	if isinstance(value, str):
+		value = parse_datetime(value)
+	if is_naive(value):
+		value = make_aware(value, utc)
+	return value
+
+
+# write hot ranks given as msg id -> (votes, hot), a statement per VOTE_WRITE_BATCH messages. A row whose votes
+# changed since is skipped, the vote that changed it writes the rank for its own count
+def _update_hot(ranks):
+	ranks = list(ranks.items())
+	for i in range(0, len(ranks), VOTE_WRITE_BATCH):
+		batch = ranks[i:i + VOTE_WRITE_BATCH]
+		Message.objects.filter(reduce(or_, [Q(pk=msg_id, votes=votes) for msg_id, (votes, _) in batch])).update(
+			hot=Case(*[When(pk=msg_id, then=Value(hot)) for msg_id, (_, hot) in batch], output_field=FloatField())
+		)
+
+
+# remember (or forget) the count of a message, caller holds _lock
+def _remember(msg_id, votes):
+	_known.pop(msg_id, None)
+	if votes is not None:
+		_known[msg_id] = votes
+		if len(_known) > VOTE_KNOWN_MAX:
+			_known.popitem(last=False)
+
+
+# buffer a vote for a message we know, returns its projected count or None if we don't know it
+def _buffer(msg_id, delta):
+	with _lock:
+		if msg_id not in _known:
+			return None
+		_pending[msg_id] = _pending.get(msg_id, 0) + delta
+		projected = _known[msg_id] + _pending[msg_id] + _flushing.get(msg_id, 0)
+
+	_start_flusher()
+	return projected
+
+
+# write buffered votes in one transaction, if it fails they go back in the buffer for the next flush
+def flush():
+	global _pending, _flushing
+	with _lock:
+		if not _pending or _flushing:
+			return
+		_flushing, _pending = _pending, {}
+
+	try:
+		with transaction.atomic():
+			apply_votes(_flushing)
+	except Exception:
+		with _lock:
+			for msg_id, delta in _flushing.items():
+				_pending[msg_id] = _pending.get(msg_id, 0) + delta
+		raise
+	finally:
+		with _lock:
+			_flushing = {}
+
+
+# drop the buffered votes and known counts without writing them, e.g. before the database they belong to goes away
+def discard():
+	with _lock:
+		_pending.clear()
+		_known.clear()
+
+
+def _run_flusher():
+	while True:
+		time.sleep(VOTE_COALESCE_INTERVAL)
+		close_old_connections()
+		try:
+			flush()
+		except Exception as e:
+			socket_log.task("votes", "flush failed", error=e)
+		finally:
+			close_old_connections()
+
+
+def _start_flusher():
+	global _flusher
+	if _flusher is None:
+		with _lock:
+			if _flusher is None:
+				_flusher = threading.Thread(target=_run_flusher, name="drop-vote-flusher", daemon=True)
+				_flusher.start()
+				atexit.register(flush)
@@ -127,6 +127,23 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 
+# CACHES
+# shared message page cache (drop/page_cache.py), local memory is per process, use a redis
+# backed cache to share pages and invalidations between dynos
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'drop-pages',
+    },
+}
+
+
+# METRICS
+# /metrics (drop/metrics.py) is only served to staff sessions and to requests carrying
+# "Authorization: Bearer <METRICS_TOKEN>", set it in the environment of the app and the scraper
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
 # REST FRAMEWORK
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
@@ -3,7 +3,7 @@ from django.urls import path
 from django.contrib import admin
 from django.contrib.auth.views import auth_logout
 
-from drop.views import no_resource, web_portal, web_register, RegisterUserView
+from drop.views import no_resource, web_portal, web_register, api_stats, api_metrics, RegisterUserView
 
 from rest_framework_jwt.views import obtain_jwt_token, verify_jwt_token
 
@@ -15,6 +15,8 @@ urlpatterns = [
     path('api/token/', obtain_jwt_token),
     path('api/verify/', verify_jwt_token),
     path('api/register/', RegisterUserView.as_view(), name='register'),
+    path('api/stats/', api_stats, name='api_stats'),
+    path('metrics', api_metrics, name='api_metrics'),
 
     # path('api/token/', TokenObtainPairView.as_view()),
     # path('api/token/refresh', TokenRefreshView.as_view()),